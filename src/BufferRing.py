@@ -0,0 +1,37 @@
+import numpy as np
+
+class BufferRing:
+    """同じ形状の画像バッファを size 個確保しておき、順番に使い回す
+
+    acquire() が返したバッファは、その後 size - 1 回 acquire() するまで上書きされない。
+    形状が変わった時 (解像度の切り替えなど) だけ確保し直す。
+    """
+    def __init__(self, size, dtype=np.uint8):
+        self.size = max(1, int(size))
+        self.dtype = dtype
+        self._buffers = [None] * self.size
+        self._index = -1
+        self.allocations = 0
+
+    def peek(self):
+        """次に使うバッファ (未確保なら None)。書き込んだら advance() で確定する"""
+        return self._buffers[(self._index + 1) % self.size]
+
+    def advance(self, array):
+        """peek() したバッファへの書き込みを確定する
+
+        書き込み先が確保し直された場合 (cv2 の dst の形状が合わなかった時など) は、
+        その配列を以降のバッファとして使う。
+        """
+        self._index = (self._index + 1) % self.size
+        if array is not self._buffers[self._index]:
+            self._buffers[self._index] = array
+            self.allocations += 1
+        return array
+
+    def acquire(self, shape):
+        """shape の次のバッファを返す (形状が違えば確保し直す)"""
+        buffer = self.peek()
+        if buffer is None or buffer.shape != tuple(shape):
+            buffer = np.empty(shape, dtype=self.dtype)
+        return self.advance(buffer)
@@ -0,0 +1,171 @@
+import json
+import os
+import time
+import logging
+
+import cv2
+
+# 調べる FOURCC (同じ速さなら先に並んでいるものを選ぶ)。
+# test_fps2.py での計測: YUYV は高解像度で遅く、H264 は OpenCV 側で展開されず1列の画像になる
+PROBE_FOURCCS = ("MJPG", "YUYV", "H264")
+PROFILE_CACHE_VERSION = 1
+DEFAULT_CACHE_PATH = "configs/camera_profiles.json"
+
+def fourcc_to_str(value):
+    """CAP_PROP_FOURCC の値 (float) を 'MJPG' などの文字列に戻す"""
+    value = int(value)
+    return "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4)).strip("\0")
+
+def device_identity(src):
+    """キャッシュのキーにするカメラの識別子を返す
+
+    Linux では /sys/class/video4linux から機種名と USB の接続先を読み、
+    デバイス番号が入れ替わっても同じカメラを同じキーにする。
+    """
+    if isinstance(src, int):
+        sysfs = f"/sys/class/video4linux/video{src}"
+        try:
+            with open(os.path.join(sysfs, "name")) as f:
+                name = f.read().strip()
+            return f"{name}@{os.path.basename(os.path.realpath(os.path.join(sysfs, 'device')))}"
+        except OSError:
+            return f"camera:{src}"
+    return str(src)
+
+class CameraProber:
+    """FOURCC ごとに短時間フレームを読んで実際の FPS を計測し、要求を満たす最速のモードを選ぶ
+
+    結果はカメラの識別子と要求解像度・FPS をキーにして JSON に保存し、次回からは計測しない。
+    capture_factory に cv2.VideoCapture 互換のクラスを渡せば、カメラなしで動作を確認できる。
+    """
+    def __init__(self, capture_factory=cv2.VideoCapture, cache_path=DEFAULT_CACHE_PATH,
+                 fourccs=PROBE_FOURCCS, warmup_frames=5, probe_frames=20, probe_time=1.0,
+                 identity_func=device_identity):
+        self.capture_factory = capture_factory
+        self.cache_path = cache_path
+        self.fourccs = fourccs
+        # カメラの立ち上がり直後は遅いので、最初の warmup_frames フレームは計測しない
+        self.warmup_frames = warmup_frames
+        # 1モードあたり probe_frames フレーム、最大 probe_time 秒読む
+        self.probe_frames = probe_frames
+        self.probe_time = probe_time
+        self.identity_func = identity_func
+
+    @staticmethod
+    def _profile_key(width, height, fps):
+        return f"{width}x{height}@{fps}"
+
+    def load_cache(self):
+        """キャッシュ全体 {識別子: {要求モード: プロファイル}} を返す (無い・壊れている場合は空)"""
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cache.get("version") != PROFILE_CACHE_VERSION:
+            return {}
+        return cache.get("devices", {})
+
+    def save_cache(self, devices):
+        """書き込み途中で中断しても壊れないよう、一時ファイルに書いてから置き換える"""
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": PROFILE_CACHE_VERSION, "devices": devices}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    def get_profile(self, src, width, height, fps, reprobe=False):
+        """src のカメラで使うモード (dict: fourcc, width, height, fps, measured_fps) を返す
+
+        キャッシュにあればそれを返し、無ければ計測して保存する。要求を満たすモードが
+        見つからなければ None を返す。
+        """
+        identity = self.identity_func(src)
+        key = self._profile_key(width, height, fps)
+        devices = self.load_cache()
+        if not reprobe:
+            profile = devices.get(identity, {}).get(key)
+            if profile is not None:
+                logging.info(f"カメラのプロファイルをキャッシュから読み込みました ({identity}): {profile['fourcc']} "
+                             f"{profile['width']}x{profile['height']} @ {profile['measured_fps']:.1f} FPS")
+                return profile
+
+        results = self.probe(src, width, height, fps)
+        profile = self.select(results, width, height)
+        if profile is None:
+            logging.warning(f"要求 ({width}x{height} @ {fps} FPS) を満たすカメラのモードが見つかりませんでした。")
+            return None
+        try:
+            devices.setdefault(identity, {})[key] = profile
+            self.save_cache(devices)
+        except OSError:
+            logging.exception("カメラのプロファイルを保存できませんでした。")
+        logging.info(f"カメラのモードを選択しました ({identity}): {profile['fourcc']} "
+                     f"{profile['width']}x{profile['height']} @ {profile['measured_fps']:.1f} FPS")
+        return profile
+
+    def probe(self, src, width, height, fps):
+        """各 FOURCC で width x height @ fps を要求し、実際のモードと計測した FPS のリストを返す"""
+        stream = self.capture_factory(src)
+        if not stream.isOpened():
+            raise IOError("Webカメラを開けませんでした。")
+        results = []
+        try:
+            for fourcc in self.fourccs:
+                result = self._probe_mode(stream, fourcc, width, height, fps)
+                logging.info(f"カメラのモードを計測しました: {result}")
+                results.append(result)
+        finally:
+            stream.release()
+        return results
+
+    def _probe_mode(self, stream, fourcc, width, height, fps):
+        stream.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        stream.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        stream.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        stream.set(cv2.CAP_PROP_FPS, fps)
+        result = {
+            'fourcc': fourcc,
+            'actual_fourcc': fourcc_to_str(stream.get(cv2.CAP_PROP_FOURCC)),
+            'width': int(stream.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(stream.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': fps,
+            'measured_fps': 0.0,
+            'valid': False,
+        }
+        for _ in range(self.warmup_frames):
+            if not stream.grab():
+                return result
+        frames = 0
+        frame = None
+        start = time.perf_counter()
+        deadline = start + self.probe_time
+        while frames < self.probe_frames and time.perf_counter() < deadline:
+            grabbed, frame = stream.read()
+            if not grabbed:
+                break
+            frames += 1
+        elapsed = time.perf_counter() - start
+        if frames > 0 and elapsed > 0:
+            result['measured_fps'] = frames / elapsed
+        # カメラが FOURCC を受け付けなかった場合や、展開できない形式 (1列の画像) は使えない
+        # (FOURCC を返さないバックエンドもあるので、空の場合は画像の形状だけで判定する)
+        result['valid'] = (frame is not None and result['actual_fourcc'] in (fourcc, '')
+                           and frame.shape == (result['height'], result['width'], 3))
+        return result
+
+    @staticmethod
+    def select(results, width, height):
+        """要求解像度以上の有効なモードのうち、計測した FPS が最も高いものを返す"""
+        candidates = [
+            result for result in results
+            if result['valid'] and result['width'] >= width and result['height'] >= height
+        ]
+        if not candidates:
+            return None
+        # 同じ FPS (誤差 5% 以内) なら先に調べた FOURCC を優先する
+        best_fps = max(result['measured_fps'] for result in candidates)
+        best = next(result for result in candidates if result['measured_fps'] >= best_fps * 0.95)
+        return {name: best[name] for name in ('fourcc', 'width', 'height', 'fps', 'measured_fps')}
@@ -0,0 +1,154 @@
+import multiprocessing as mp
+import queue
+import time
+import logging
+
+from FrameSource import CaptureStateMixin
+from SharedFrameRing import SharedFrameRing
+
+def _capture_main(src, width, height, fps, fourcc, command_queue, status_queue):
+    """キャプチャプロセス: カメラから共有メモリのリングに直接デコードし続ける"""
+    # カメラの設定・モードの切り替えは WebcamVideoStream と同じものを使う (キャプチャスレッドは起動しない)
+    from WebcamVideoStream import WebcamVideoStream
+    try:
+        camera = WebcamVideoStream(src=src, width=width, height=height, fps=fps, fourcc=fourcc)
+    except IOError as e:
+        status_queue.put(('error', str(e)))
+        return
+    status_queue.put(('opened', camera.get_actual_props()))
+    ring_name = command_queue.get()
+    if ring_name is None:
+        camera.stream.release()
+        return
+
+    ring = SharedFrameRing.attach(ring_name)
+    stream = camera.stream
+    actual_width, actual_height = camera.get_actual_props()[:2]
+    shape = (actual_height, actual_width, 3)
+    last_publish_time = 0.0
+    view = frame = None
+    try:
+        while True:
+            try:
+                command = command_queue.get_nowait()
+            except queue.Empty:
+                command = None
+            if command is not None:
+                if command[0] == 'stop':
+                    break
+                if command[0] == 'mode':
+                    _, name, mode_width, mode_height, mode_fps = command
+                    camera.add_capture_mode(name, mode_width, mode_height, mode_fps)
+                    camera.set_mode(name)
+                    if camera._pending_mode is not None:
+                        camera._apply_pending_mode()
+
+            view = ring.writable_view(shape)
+            grabbed, frame = stream.read(view)
+            if not grabbed:
+                logging.error("ストリームの終端またはエラー。キャプチャプロセスを停止します。")
+                break
+            frame_time = time.perf_counter()
+            if frame_time - last_publish_time < camera._min_frame_interval:
+                continue
+            last_publish_time = frame_time
+            if frame is view:
+                ring.publish(shape, frame_time)
+            else:
+                # 解像度が変わった場合はデコーダが確保した配列からコピーし、次からはその形状で書く
+                ring.write(frame, frame_time)
+                shape = frame.shape
+    except Exception:
+        logging.exception("キャプチャプロセスでエラーが発生しました。")
+    finally:
+        ring.close_stream()
+        del view, frame
+        ring.close()
+        stream.release()
+
+class CaptureProcess(CaptureStateMixin):
+    """カメラの読み込みを別プロセスで行い、フレームを共有メモリのリング (SharedFrameRing) で受け取る
+
+    WebcamVideoStream と同じインターフェースを持ち、キャプチャとデコードがメインプロセスの GIL を
+    使わなくなる。read 系が返すフレームは共有メモリ上のビューで、slots - 1 フレーム後に
+    上書きされるので、すぐにコピー (反転など) すること。
+    """
+    def __init__(self, src=0, width=1280, height=720, fps=30, slots=4, timeout=10.0, fourcc='MJPG'):
+        ctx = mp.get_context("spawn")
+        self._commands = ctx.Queue()
+        self._status = ctx.Queue()
+        self.process = ctx.Process(target=_capture_main, name="capture", daemon=True,
+                                   args=(src, width, height, fps, fourcc, self._commands, self._status))
+        self.process.start()
+        try:
+            kind, payload = self._status.get(timeout=timeout)
+        except queue.Empty:
+            self.process.terminate()
+            raise IOError(f"{timeout}秒以内にキャプチャプロセスがカメラを開けませんでした。")
+        if kind == 'error':
+            self.process.join(timeout=1.0)
+            raise IOError(payload)
+        self._props = payload
+        actual_width, actual_height = payload[:2]
+        # 実解像度に合わせてリングを作り、キャプチャプロセスに渡す (共有メモリの所有者はこちら)
+        self.ring = SharedFrameRing.create((max(actual_height, 1), max(actual_width, 1), 3), slots)
+        self._commands.put(self.ring.name)
+
+        self._stopped = False
+        self._init_capture_state(width, height, fps)
+
+    @property
+    def stopped(self):
+        return self._stopped or self.ring.closed_by_writer
+
+    def start(self, timeout=5.0):
+        """最初のフレームが届くまで (最大 timeout 秒) 待つ"""
+        if self.ring.read_new(0, timeout)[0] is None:
+            logging.warning(f"{timeout}秒以内に最初のフレームを取得できませんでした。")
+        return self
+
+    def _request_mode(self, name):
+        """キャプチャプロセスに切り替えを依頼する (次の読み込みの前に反映される)"""
+        if name == self.mode:
+            return
+        self._commands.put(('mode', name) + self.capture_modes[name])
+        self._switch_mode(name)
+
+    def read(self):
+        frame_id, _, frame = self.ring.read_latest()
+        self._consume(frame_id)
+        return frame
+
+    def read_with_info(self):
+        """最新フレームを (フレーム番号, 取得時刻, フレーム) で返す (新しいフレームを待たない)"""
+        frame_id, frame_time, frame = self.ring.read_latest()
+        self._consume(frame_id)
+        return frame_id, frame_time, frame
+
+    def read_new(self, timeout=None):
+        """前回読んだものより新しいフレームが届くまで待ち、(フレーム番号, 取得時刻, フレーム) を返す"""
+        if self._stopped:
+            return None, None, None
+        frame_id, frame_time, frame = self.ring.read_new(self._last_read_id, timeout)
+        self._consume(frame_id)
+        return frame_id, frame_time, frame
+
+    def get_stats(self):
+        """取得フレーム数・重複読み出し数・取りこぼしフレーム数を返す"""
+        # キャプチャプロセスは他プロセスの読み出し状況を知らないので、全フレームをデコードする
+        latest_id = self.ring.latest_id
+        return self._read_stats(latest_id, latest_id, latest_id)
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._commands.put(('stop',))
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close()
+        logging.info("キャプチャプロセスを停止し、共有メモリを解放しました。")
+
+    def get_actual_props(self):
+        return self._props
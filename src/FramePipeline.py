@@ -0,0 +1,177 @@
+import collections
+import threading
+import time
+import logging
+
+class FramePacket:
+    """パイプラインを流れる1フレーム分のデータ (フレーム番号で識別する)"""
+    __slots__ = ('frame_id', 'timestamp', 'frame', 'scale', 'hands', 'inferred', 'static', 'key_indices')
+
+    def __init__(self, frame_id, timestamp, frame, scale=1.0):
+        self.frame_id = frame_id
+        self.timestamp = timestamp  # キャプチャ時刻 (time.perf_counter)
+        self.frame = frame
+        self.scale = scale       # 表示・キー判定の解像度に対する frame の倍率 (縮小展開したフレームは 1 未満)
+        self.hands = None        # HandLandmarks (画素座標)
+        self.inferred = True     # hands がこのフレームの推論結果か (False なら前のフレームの使い回し)
+        self.static = False      # 動きがないため推論を省いたフレームか (手は前の推論時から動いていない)
+        self.key_indices = None  # hands.fingertips() の各点が乗っているキー番号 (-1 はキー外)
+
+class LatestValueQueue:
+    """容量付きのキュー。満杯時の挙動を drop_policy で選ぶ
+
+    - "drop_oldest": 最も古い要素を捨てて新しい要素を入れる (常に最新値を優先)
+    - "drop_newest": 新しい要素を捨てる
+    - "block": 空きができるまで put を待たせる
+    """
+    DROP_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, maxsize=1, drop_policy="drop_oldest"):
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError(f"不明な drop_policy です: {drop_policy}")
+        self.maxsize = max(1, int(maxsize))
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.closed = False
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, item, timeout=None):
+        """要素を追加する。追加できなかった場合は False を返す
+
+        block で timeout 秒以内に空きができなかった場合は数えない (呼び出し側が再試行する)。
+        """
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.drop_policy == "drop_oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                elif self.drop_policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                elif not self._cond.wait_for(
+                        lambda: len(self._items) < self.maxsize or self.closed, timeout):
+                    return False
+            if self.closed:
+                self.dropped += 1
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """要素を取り出す。timeout 秒以内に届かないか、閉じられていれば None を返す"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self.closed, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """待機中の put/get をすべて起こし、以降の追加を受け付けない"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+class FramePipeline:
+    """キャプチャと各処理ステージを別スレッドで動かし、最新値キューでつなぐ
+
+    source() は FramePacket (取得できなければ None) を返す関数、stages は (名前, 関数) のリスト。
+    各関数は FramePacket を受け取って処理済みの FramePacket を返す。最後のステージの出力は
+    get() で取り出す (描画は呼び出し元のスレッドで行う)。フレーム N+1 の推論と
+    フレーム N の描画が重なって実行される。
+    """
+    def __init__(self, source, stages, queue_size=1, drop_policy="drop_oldest"):
+        self.source = source
+        self.stages = list(stages)
+        self.queues = [LatestValueQueue(queue_size, drop_policy) for _ in range(len(self.stages) + 1)]
+        self.stopped = False
+        self.threads = []
+        self._stage_counts = collections.defaultdict(int)
+        self._stage_times = collections.defaultdict(float)
+        self._last_output_id = 0
+        self.stale_outputs = 0  # 追い越されて捨てた古い結果の数
+
+    def start(self):
+        self.stopped = False
+        self.threads = [threading.Thread(target=self._run_source, name="pipeline-capture", daemon=True)]
+        for i, (name, func) in enumerate(self.stages):
+            self.threads.append(threading.Thread(
+                target=self._run_stage, args=(name, func, self.queues[i], self.queues[i + 1]),
+                name=f"pipeline-{name}", daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _run_source(self):
+        out_queue = self.queues[0]
+        while not self.stopped:
+            packet = self.source()
+            if packet is None:
+                continue
+            self._put(out_queue, packet)
+
+    def _put(self, out_queue, packet):
+        """packet を次のキューに入れる。block では停止されるまで空きを待ち続ける"""
+        while not out_queue.put(packet, timeout=0.5):
+            if out_queue.drop_policy != "block" or out_queue.closed:
+                return False
+            if self.stopped:
+                # 停止中で閉じられる前のキューに入れられなかったフレームも破棄として数える
+                with out_queue._cond:
+                    out_queue.dropped += 1
+                return False
+        return True
+
+    def _run_stage(self, name, func, in_queue, out_queue):
+        while not self.stopped:
+            packet = in_queue.get(timeout=0.5)
+            if packet is None:
+                continue
+            start = time.perf_counter()
+            try:
+                packet = func(packet)
+            except Exception:
+                logging.exception(f"パイプラインのステージ '{name}' でエラーが発生しました。")
+                continue
+            self._stage_times[name] += time.perf_counter() - start
+            self._stage_counts[name] += 1
+            if packet is not None:
+                self._put(out_queue, packet)
+
+    def get(self, timeout=None):
+        """最後のステージの結果を取り出す。既に出力したものより古いフレームは捨てる"""
+        while True:
+            packet = self.queues[-1].get(timeout)
+            if packet is None or packet.frame_id > self._last_output_id:
+                break
+            self.stale_outputs += 1
+        if packet is not None:
+            self._last_output_id = packet.frame_id
+        return packet
+
+    def stop(self):
+        self.stopped = True
+        for q in self.queues:
+            q.close()
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join(timeout=1.0)
+
+    def get_stats(self):
+        """ステージごとの処理数・平均処理時間 (ms) と、キューごとの破棄数を返す"""
+        stages = {}
+        for name, _ in self.stages:
+            count = self._stage_counts[name]
+            stages[name] = {
+                'processed': count,
+                'avg_ms': self._stage_times[name] / count * 1000 if count else 0.0,
+            }
+        return {
+            'stages': stages,
+            'dropped': [q.dropped for q in self.queues],
+            'stale_outputs': self.stale_outputs,
+        }
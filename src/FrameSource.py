@@ -0,0 +1,339 @@
+import collections
+import glob
+import os
+import threading
+import time
+import logging
+
+import cv2
+import numpy as np
+
+from BufferRing import BufferRing
+
+class CaptureStateMixin:
+    """キャプチャモードの切り替え・滞在時間の記録と、読んだフレームの重複・取りこぼしの集計
+
+    FrameSource (供給スレッド) と CaptureProcess (キャプチャプロセス) で共通の部分。
+    モードの実際の切り替え方はサブクラスの _request_mode で決める。
+    """
+    def _init_capture_state(self, width, height, fps):
+        self._last_read_id = 0
+        self.duplicate_reads = 0  # 前回と同じフレームを読んだ回数
+        self.dropped_frames = 0   # 一度も読まれなかったフレーム数
+
+        # キャプチャモード名 -> (幅, 高さ, FPS)。カメラ以外では切り替えても何もしない
+        self.capture_modes = {'active': (width, height, fps)}
+        self.mode = 'active'
+        self._mode_since = time.perf_counter()
+        self._mode_times = collections.defaultdict(float)
+
+    def add_capture_mode(self, name, width, height, fps):
+        """set_mode() で切り替えられるキャプチャモードを追加する"""
+        self.capture_modes[name] = (width, height, fps)
+
+    def set_mode(self, name):
+        """キャプチャモードを切り替える"""
+        if name not in self.capture_modes:
+            raise ValueError(f"不明なキャプチャモードです: {name}")
+        self._request_mode(name)
+
+    def _request_mode(self, name):
+        """モードの切り替えを反映する (既定ではモードごとの時間を記録するだけ)"""
+        self._switch_mode(name)
+
+    def _switch_mode(self, name):
+        """現在のモードの滞在時間を記録し、name に切り替える"""
+        if name == self.mode:
+            return
+        now = time.perf_counter()
+        self._mode_times[self.mode] += now - self._mode_since
+        self._mode_since = now
+        width, height, fps = self.capture_modes[name]
+        logging.info(f"キャプチャモードを {self.mode} -> {name} に変更しました: {width}x{height} @ {fps} FPS")
+        self.mode = name
+
+    def get_mode_times(self):
+        """キャプチャモードごとの滞在時間 [s] を返す"""
+        times = dict(self._mode_times)
+        times[self.mode] = times.get(self.mode, 0.0) + time.perf_counter() - self._mode_since
+        return times
+
+    def _min_publish_interval(self, fps):
+        """FPS が fps のモードで、配信するフレームの最小間隔 [s] を返す"""
+        # カメラが FPS 指定を無視する場合に備え、モードの FPS を超える分は配信しない
+        return 1.0 / fps * 0.9 if fps < self.capture_modes['active'][2] else 0.0
+
+    def _consume(self, frame_id):
+        """フレーム番号 frame_id を読んだことを記録し、重複・取りこぼしを数える"""
+        if not frame_id:
+            return
+        if frame_id == self._last_read_id:
+            self.duplicate_reads += 1
+        elif frame_id > self._last_read_id + 1 and self._last_read_id > 0:
+            self.dropped_frames += frame_id - self._last_read_id - 1
+        self._last_read_id = frame_id
+
+    def _read_stats(self, captured, grabbed, decoded):
+        return {
+            'captured': captured,
+            'grabbed': grabbed,
+            'decoded': decoded,
+            'duplicate_reads': self.duplicate_reads,
+            'dropped_frames': self.dropped_frames,
+        }
+
+class FrameSource(CaptureStateMixin):
+    """フレームの供給元の共通部分
+
+    サブクラスは供給スレッドの本体 update() を実装し、その中で _publish() したフレームを
+    read_new() などで受け取る。終端に達したら _end_of_stream() を呼ぶ。
+    WebcamVideoStream・動画ファイル・画像フォルダ・合成フレームを main.py から同じように扱える。
+    realtime=False のソースは読み出し側が前のフレームを読むまで次のフレームを出さないので、
+    フレームを落とさずに処理できる最大のスループットを測れる。
+    """
+    def __init__(self, width, height, fps, realtime=True):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.realtime = realtime
+        self.passthrough = False  # JPEG のバイト列のまま配信するか (WebcamVideoStream のみ)
+
+        # 最初のフレームは供給スレッドが取得し、取得できた時点でイベントを立てる
+        self.grabbed = False
+        self.frame = None
+        self.first_frame_ready = threading.Event()
+
+        # フレーム番号 (1始まり、0は未取得) と取得時刻 (time.perf_counter)
+        self.frame_id = 0
+        self.frame_time = None
+        # 新しいフレームの到着を read_new() に、フレームが読まれたことを供給スレッドに知らせる条件変数
+        self._frame_cond = threading.Condition()
+        # 読み出し側が次のフレームを求めているか (WebcamVideoStream はこの間だけデコードする)
+        self._frame_requested = False
+        self._init_capture_state(width, height, fps)
+
+        self.stopped = False
+        self.thread = threading.Thread(target=self.update, args=())
+        self.thread.daemon = True
+
+    def start(self, timeout=5.0):
+        self.stopped = False
+        self.thread.start()
+        # 固定時間待つ代わりに、最初のフレームが届くまで (最大 timeout 秒) 待つ
+        if not self.first_frame_ready.wait(timeout):
+            logging.warning(f"{timeout}秒以内に最初のフレームを取得できませんでした。")
+        return self
+
+    def _publish(self, frame, frame_time=None, frame_id=None):
+        """frame を最新フレームとして公開する (供給スレッドから呼ぶ)"""
+        with self._frame_cond:
+            self.grabbed = True
+            self.frame = frame
+            self.frame_id = self.frame_id + 1 if frame_id is None else frame_id
+            self.frame_time = time.perf_counter() if frame_time is None else frame_time
+            self._frame_requested = False
+            self._frame_cond.notify_all()
+        self.first_frame_ready.set()
+
+    def _end_of_stream(self, message=None):
+        """供給を終了し、待機中の read_new() と start() を起こす"""
+        if message is not None:
+            logging.info(message)
+        self.stopped = True
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        self.first_frame_ready.set()
+
+    def _pace(self, index, start_time):
+        """index 番目 (0始まり) のフレームを出してよい時まで待つ (停止されたら False)
+
+        realtime なら fps に合わせて待ち、そうでなければ前のフレームが読まれるまで待つ。
+        """
+        if self.realtime:
+            delay = start_time + index / self.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            return not self.stopped
+        with self._frame_cond:
+            self._frame_cond.wait_for(lambda: self._last_read_id >= self.frame_id or self.stopped)
+        return not self.stopped
+
+    def read(self):
+        with self._frame_cond:
+            self._consume(self.frame_id)
+            self._frame_requested = True
+            return self.frame
+
+    def read_with_info(self):
+        """最新フレームを (フレーム番号, 取得時刻, フレーム) で返す (新しいフレームを待たない)"""
+        with self._frame_cond:
+            self._consume(self.frame_id)
+            self._frame_requested = True
+            return self.frame_id, self.frame_time, self.frame
+
+    def read_new(self, timeout=None):
+        """前回読んだものより新しいフレームが届くまで待ち、(フレーム番号, 取得時刻, フレーム) を返す
+
+        timeout 秒以内に届かない場合やストリームが停止した場合は (None, None, None) を返す。
+        """
+        with self._frame_cond:
+            if self.frame_id <= self._last_read_id:
+                self._frame_requested = True
+            if not self._frame_cond.wait_for(
+                    lambda: self.frame_id > self._last_read_id or self.stopped, timeout):
+                return None, None, None
+            if self.frame_id <= self._last_read_id:
+                return None, None, None
+            self._consume(self.frame_id)
+            return self.frame_id, self.frame_time, self.frame
+
+    def _consume(self, frame_id):
+        """フレーム番号 frame_id を読んだことを記録する (ロック内で呼ぶ)"""
+        super()._consume(frame_id)
+        # realtime でないソースの供給スレッドは、フレームが読まれるのを待っている
+        self._frame_cond.notify_all()
+
+    def get_stats(self):
+        """取得・デコードしたフレーム数、重複読み出し数、取りこぼしフレーム数を返す"""
+        with self._frame_cond:
+            return self._read_stats(self.frame_id, self.frame_id, self.frame_id)
+
+    def stop(self):
+        self.stopped = True
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        if self.thread.is_alive() and threading.current_thread() is not self.thread:
+            self.thread.join(timeout=1.0)
+        self._release()
+
+    def _release(self):
+        """供給元のリソースを解放する (サブクラスで必要なら実装する)"""
+
+    def get_actual_props(self):
+        """(幅, 高さ, FPS, フォーカス) を返す (フォーカスはカメラ以外では None)"""
+        return self.width, self.height, self.fps, None
+
+class VideoFileSource(FrameSource):
+    """動画ファイルをフレームの供給元にする (realtime なら動画の FPS で、そうでなければ処理できる速さで読む)"""
+    def __init__(self, path, realtime=True, loop=False, ring_size=4):
+        self.path = path
+        self.stream = cv2.VideoCapture(path)
+        if not self.stream.isOpened():
+            raise IOError(f"動画ファイルを開けませんでした: {path}")
+        width = int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = self.stream.get(cv2.CAP_PROP_FPS) or 30.0
+        super().__init__(width, height, fps, realtime)
+        self.loop = loop
+        self._ring = BufferRing(ring_size)
+
+    def update(self):
+        start_time = time.perf_counter()
+        index = 0
+        while not self.stopped:
+            buffer = self._ring.peek()
+            (grabbed, frame) = self.stream.read(buffer) if buffer is not None else self.stream.read()
+            if not grabbed:
+                if self.loop and index > 0:
+                    self.stream.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                self._end_of_stream(f"動画ファイルの終端に達しました ({index} フレーム)。")
+                break
+            if not self._pace(index, start_time):
+                break
+            self._ring.advance(frame)
+            self._publish(frame)
+            index += 1
+
+    def _release(self):
+        self.stream.release()
+        logging.info(f"動画ファイルを閉じました: {self.path}")
+
+class ImageDirectorySource(FrameSource):
+    """フォルダ内の画像をファイル名順にフレームとして供給する"""
+    EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, directory, fps=30, realtime=True, loop=False):
+        self.paths = sorted(path for path in glob.glob(os.path.join(directory, "*"))
+                            if path.lower().endswith(self.EXTENSIONS))
+        if not self.paths:
+            raise IOError(f"画像が見つかりませんでした: {directory}")
+        first = cv2.imread(self.paths[0])
+        if first is None:
+            raise IOError(f"画像を読み込めませんでした: {self.paths[0]}")
+        height, width = first.shape[:2]
+        super().__init__(width, height, fps, realtime)
+        self.loop = loop
+
+    def update(self):
+        start_time = time.perf_counter()
+        index = 0
+        while not self.stopped:
+            if index >= len(self.paths) and not self.loop:
+                self._end_of_stream(f"すべての画像を供給しました ({index} フレーム)。")
+                break
+            path = self.paths[index % len(self.paths)]
+            frame = cv2.imread(path)
+            if frame is None:
+                logging.warning(f"画像を読み込めませんでした。スキップします: {path}")
+                index += 1
+                continue
+            if not self._pace(index, start_time):
+                break
+            self._publish(frame)
+            index += 1
+
+class SyntheticSource(FrameSource):
+    """カメラなしで負荷試験するための合成フレーム (動く円とノイズの背景) を供給する
+
+    num_frames を指定するとそのフレーム数で終了する (None なら止めるまで続ける)。
+    """
+    def __init__(self, width=640, height=360, fps=30, realtime=True, num_frames=None, ring_size=4, seed=0):
+        super().__init__(width, height, fps, realtime)
+        self.num_frames = num_frames
+        self._ring = BufferRing(ring_size)
+        rng = np.random.default_rng(seed)
+        background = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+        self._background = cv2.resize(background, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    def update(self):
+        start_time = time.perf_counter()
+        index = 0
+        radius = max(4, min(self.width, self.height) // 10)
+        while not self.stopped:
+            if self.num_frames is not None and index >= self.num_frames:
+                self._end_of_stream(f"合成フレームを {index} フレーム供給しました。")
+                break
+            if not self._pace(index, start_time):
+                break
+            frame = self._ring.acquire((self.height, self.width, 3))
+            np.copyto(frame, self._background)
+            # 約4秒で画面を1周する円を描き、フレーム間に動きを与える
+            phase = index / (self.fps * 4.0) * 2 * np.pi
+            center = (int(self.width * (0.5 + 0.35 * np.cos(phase))), int(self.height * (0.5 + 0.35 * np.sin(phase))))
+            cv2.circle(frame, center, radius, (80, 160, 220), -1)
+            self._publish(frame)
+            index += 1
+
+# create_frame_source() が受け付ける種類
+SOURCE_KINDS = ("camera", "video", "images", "synthetic")
+
+def parse_source_spec(spec):
+    """"camera[:番号]" / "video:PATH" / "images:DIR" / "synthetic[:フレーム数]" を (種類, 引数) に分ける"""
+    kind, _, arg = spec.partition(":")
+    if kind not in SOURCE_KINDS:
+        raise ValueError(f"不明なフレームの供給元です: {spec}")
+    if kind in ("video", "images") and not arg:
+        raise ValueError(f"{kind} にはパスを指定してください (例: {kind}:PATH)")
+    return kind, arg
+
+def create_frame_source(spec, width=640, height=360, fps=30, realtime=True, loop=False):
+    """カメラ以外のフレームの供給元を作る (カメラは WebcamVideoStream / CaptureProcess を直接使う)"""
+    kind, arg = parse_source_spec(spec)
+    if kind == "video":
+        return VideoFileSource(arg, realtime=realtime, loop=loop)
+    if kind == "images":
+        return ImageDirectorySource(arg, fps=fps, realtime=realtime, loop=loop)
+    if kind == "synthetic":
+        return SyntheticSource(width, height, fps, realtime=realtime, num_frames=int(arg) if arg else None)
+    raise ValueError("カメラは WebcamVideoStream で開いてください。")
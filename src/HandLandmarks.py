@@ -0,0 +1,40 @@
+import numpy as np
+
+NUM_LANDMARKS = 21
+FINGER_TIPS = (4, 8, 12, 16, 20)
+
+class HandLandmarks:
+    """1フレーム分の手のランドマークを配列で保持する (MediaPipe の protobuf は保持しない)
+
+    landmarks は (手の数, 21, 3) float32 の画素座標。z は MediaPipe と同様に x と同じ尺度
+    (正規化 z × 画像幅) で、大きいほどカメラから遠い。
+    handedness は (手の数,) uint8 で、MediaPipe の判定が "Right" なら 1。
+    """
+    __slots__ = ('landmarks', 'handedness')
+
+    def __init__(self, landmarks, handedness):
+        self.landmarks = landmarks
+        self.handedness = handedness
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0, NUM_LANDMARKS, 3), dtype=np.float32), np.empty(0, dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.handedness)
+
+    def labels(self):
+        """手ごとのラベル ("Left" / "Right")。映像を反転して推論しているため MediaPipe の左右を入れ替える"""
+        return ["Left" if is_right else "Right" for is_right in self.handedness.tolist()]
+
+    def fingertips(self):
+        """指先の画素座標 (手の数 * 5, 2)。手の順・FINGER_TIPS の順に並ぶ"""
+        return self.landmarks[:, FINGER_TIPS, :2].reshape(-1, 2)
+
+    def fingertip_depths(self):
+        """指先の z (手の数 * 5,)。fingertips と同じ順"""
+        return self.landmarks[:, FINGER_TIPS, 2].reshape(-1)
+
+    def fingertip_owners(self):
+        """fingertips の各点の (手の番号, tip_id)"""
+        return [(hand_index, tip_id) for hand_index in range(len(self)) for tip_id in FINGER_TIPS]
@@ -0,0 +1,175 @@
+import threading
+
+import cv2
+import numpy as np
+
+from HandLandmarks import HandLandmarks, NUM_LANDMARKS
+
+# mediapipe.solutions.hands.HAND_CONNECTIONS と同じ接続 (mediapipe を import せずに描画するため)
+HAND_CONNECTIONS = (
+    (0, 1), (1, 2), (2, 3), (3, 4),
+    (0, 5), (5, 6), (6, 7), (7, 8),
+    (5, 9), (9, 10), (10, 11), (11, 12),
+    (9, 13), (13, 14), (14, 15), (15, 16),
+    (13, 17), (0, 17), (17, 18), (18, 19), (19, 20),
+)
+
+def roi_from_corners(corners, margin=(40, 120, 40, 40)):
+    """キーボード4角の外接矩形を margin (左, 上, 右, 下) [px] だけ広げた ROI (x0, y0, x1, y1) を返す
+
+    上側の余白はキーの上にかざした手全体が入るよう大きめにとる。画面外へのはみ出しは
+    process_frame 側でフレームの範囲に切り詰める。
+    """
+    corners = np.asarray(corners, dtype=np.float32).reshape(-1, 2)
+    left, top, right, bottom = margin
+    x0 = int(np.floor(corners[:, 0].min())) - left
+    y0 = int(np.floor(corners[:, 1].min())) - top
+    x1 = int(np.ceil(corners[:, 0].max())) + right
+    y1 = int(np.ceil(corners[:, 1].max())) + bottom
+    return x0, y0, x1, y1
+
+class HandTracker:
+    def __init__(self, max_num_hands=2, min_detection_confidence=0.7, min_tracking_confidence=0.5,
+                 roi=None, inference_scale=1.0, model_complexity=1, frame_skip=0, motion_gate=None):
+        # mediapipe の import は重いので、並列初期化のスレッド内で行う
+        import mediapipe as mp
+        self.mp_hands = mp.solutions.hands
+        self.hands_params = {
+            'max_num_hands': max_num_hands,
+            'model_complexity': model_complexity,
+            'min_detection_confidence': min_detection_confidence,
+            'min_tracking_confidence': min_tracking_confidence,
+        }
+        self.hands = self.mp_hands.Hands(**self.hands_params)
+        # 推論する領域 (x0, y0, x1, y1)。None ならフレーム全体
+        self.roi = roi
+        # 推論に渡す画像の縮小倍率 (表示・キー判定は元の解像度のまま)
+        self.inference_scale = inference_scale
+        # 推論を省略して直前の結果を使い回すフレーム数 (0 なら毎フレーム推論)
+        self.frame_skip = frame_skip
+        self._skip_count = 0
+        self._last_hands = None
+        # 推論用の縮小・RGB 変換の出力先 (形状が変わらない限り毎フレーム使い回す)
+        self._resize_buffer = None
+        self._rgb_buffer = None
+        # 直前の process_frame で実際に推論したか (False なら前回の結果を使い回した)
+        self.last_inferred = False
+        # 直前の process_frame が MotionGate で静止と判定されたか (手は動いていない)
+        self.last_static = False
+        # 静止フレームの推論を省く MotionGate (None なら使わない)
+        self.motion_gate = motion_gate
+        # configure() で要求され、次の process_frame で反映する設定
+        self._pending_config = None
+        self._config_lock = threading.Lock()
+
+    def configure(self, **settings):
+        """inference_scale / frame_skip / model_complexity / max_num_hands を変更する
+
+        別スレッドで推論中でも安全なよう、次の process_frame の先頭で反映する。
+        反映前に複数回呼ばれた場合は、後の呼び出しの値で上書きしながらまとめて反映する。
+        """
+        with self._config_lock:
+            self._pending_config = {**(self._pending_config or {}), **settings}
+
+    def _apply_pending_config(self):
+        with self._config_lock:
+            settings, self._pending_config = self._pending_config, None
+        self.inference_scale = settings.get('inference_scale', self.inference_scale)
+        self.frame_skip = settings.get('frame_skip', self.frame_skip)
+        hands_params = dict(self.hands_params)
+        for name in ('model_complexity', 'max_num_hands'):
+            if name in settings:
+                hands_params[name] = settings[name]
+        if hands_params != self.hands_params:
+            # モデル設定の変更は Hands を作り直す
+            self.hands.close()
+            self.hands_params = hands_params
+            self.hands = self.mp_hands.Hands(**self.hands_params)
+            self._last_hands = None
+            if self.motion_gate is not None:
+                self.motion_gate.reset()
+
+    def set_roi(self, roi):
+        """推論する領域 (x0, y0, x1, y1) を設定する (None でフレーム全体)"""
+        self.roi = roi
+    
+    def process_frame(self, frame, scale=1.0):
+        """フレームの手を検出し、ランドマークを画素座標の HandLandmarks で返す
+
+        scale は全解像度に対する frame の倍率 (縮小展開したフレーム)。ROI・inference_scale・
+        返すランドマークは全解像度の座標で扱う。
+        """
+        if self._pending_config is not None:
+            self._apply_pending_config()
+        self.last_inferred = False
+        self.last_static = False
+        if self.frame_skip > 0 and self._last_hands is not None:
+            # (frame_skip + 1) フレームに1回だけ推論し、間のフレームは直前の結果を使う
+            self._skip_count += 1
+            if self._skip_count <= self.frame_skip:
+                return self._last_hands
+        if (self.motion_gate is not None and self._last_hands is not None
+                and not self.motion_gate.needs_inference(frame, scale)):
+            # 手元に動きがなければ直前の結果 (指先の位置) をそのまま使う
+            self.last_static = True
+            return self._last_hands
+        self._skip_count = 0
+        self._last_hands = self._infer(frame, scale)
+        self.last_inferred = True
+        return self._last_hands
+
+    def _infer(self, frame, scale=1.0):
+        # ROI が指定されていればその部分だけを切り出して推論する
+        height, width = frame.shape[:2]
+        if self.roi is not None:
+            x0, y0, x1, y1 = (int(round(v * scale)) for v in self.roi)
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, width), min(y1, height)
+            crop = frame[y0:y1, x0:x1]
+        else:
+            x0, y0, x1, y1 = 0, 0, width, height
+            crop = frame
+        # 縮小展開・省電力モードで既に推論解像度より小さいフレームは拡大しない
+        resize_scale = self.inference_scale / scale
+        if resize_scale < 1.0 - 1e-6:
+            # 正規化座標は画像サイズに依存しないので、縮小してもランドマークはそのまま元の座標に戻せる
+            crop = self._resize_buffer = cv2.resize(
+                crop, None, dst=self._resize_buffer, fx=resize_scale, fy=resize_scale,
+                interpolation=cv2.INTER_AREA)
+        if self._rgb_buffer is not None:
+            self._rgb_buffer.flags.writeable = True
+        rgb_frame = self._rgb_buffer = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB, dst=self._rgb_buffer)
+        rgb_frame.flags.writeable = False
+        results = self.hands.process(rgb_frame)
+        return self.results_to_landmarks(results, (x0 / scale, y0 / scale, (x1 - x0) / scale, (y1 - y0) / scale))
+
+    @staticmethod
+    def results_to_landmarks(results, rect):
+        """MediaPipe の結果を、rect (x, y, 幅, 高さ) の領域で推論したものとしてフレームの画素座標に変換する
+
+        protobuf からは1回だけ値を読み出し、座標変換は配列でまとめて行う。
+        """
+        if not (results.multi_handedness and results.multi_hand_landmarks):
+            return HandLandmarks.empty()
+        landmarks = np.empty((len(results.multi_hand_landmarks), NUM_LANDMARKS, 3), dtype=np.float32)
+        for hand_index, hand_landmarks in enumerate(results.multi_hand_landmarks):
+            landmarks[hand_index] = [(landmark.x, landmark.y, landmark.z) for landmark in hand_landmarks.landmark]
+        rect_x, rect_y, rect_w, rect_h = rect
+        # z は推論した画像の幅と同じスケール
+        landmarks *= np.float32((rect_w, rect_h, rect_w))
+        landmarks[:, :, 0] += rect_x
+        landmarks[:, :, 1] += rect_y
+        handedness = np.array([
+            handedness.classification[0].label == "Right" for handedness in results.multi_handedness
+        ], dtype=np.uint8)
+        return HandLandmarks(landmarks, handedness)
+
+    @staticmethod
+    def draw_landmarks(frame, hands):
+        """HandLandmarks を mediapipe の draw_landmarks と同じ見た目で描画する"""
+        for hand_landmarks in hands.landmarks:
+            points = np.round(hand_landmarks[:, :2]).astype(np.int32)
+            for start, end in HAND_CONNECTIONS:
+                cv2.line(frame, tuple(points[start]), tuple(points[end]), (224, 224, 224), 2)
+            for x, y in points:
+                cv2.circle(frame, (int(x), int(y)), 2, (0, 0, 255), 2)
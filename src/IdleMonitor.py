@@ -0,0 +1,27 @@
+import time
+import logging
+
+class IdleMonitor:
+    """手が映らない状態が idle_after 秒続いたら "idle"、手が現れたら即座に "active" へ切り替える"""
+    def __init__(self, idle_after=10.0):
+        self.idle_after = idle_after
+        self.mode = 'active'
+        self._last_hand_time = time.perf_counter()
+        self.transitions = 0
+
+    def update(self, hand_present, now=None):
+        """1フレーム分の手の有無を記録する。モードが変わった場合は新しいモード名を返す (それ以外は None)"""
+        now = time.perf_counter() if now is None else now
+        if hand_present:
+            self._last_hand_time = now
+            if self.mode == 'idle':
+                return self._change('active', "手を検出")
+        elif self.mode == 'active' and now - self._last_hand_time >= self.idle_after:
+            return self._change('idle', f"{self.idle_after:g}秒間手が見えない")
+        return None
+
+    def _change(self, mode, reason):
+        logging.info(f"{self.mode} -> {mode} モードに切り替えます ({reason})。")
+        self.mode = mode
+        self.transitions += 1
+        return mode
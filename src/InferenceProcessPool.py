@@ -0,0 +1,243 @@
+import collections
+import multiprocessing as mp
+import queue
+import threading
+import time
+import logging
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from FramePipeline import LatestValueQueue
+from HandLandmarks import HandLandmarks
+
+def _worker_main(task_queue, result_queue, shm_names, hands_kwargs):
+    """ワーカープロセス: 共有メモリ上のフレームで推論し、ランドマーク配列 (画素座標) だけを返す"""
+    from HandTracker import HandTracker  # mediapipe はワーカー側でのみ読み込む
+
+    slots = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    try:
+        tracker = HandTracker(**hands_kwargs)
+        result_queue.put(('ready', None))
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            slot, frame_id, shape = task
+            start = time.perf_counter()
+            try:
+                frame = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+                hands = tracker.process_frame(frame)
+                landmarks, handedness = hands.landmarks, hands.handedness
+                inferred, static = tracker.last_inferred, tracker.last_static
+            except Exception:
+                logging.exception(f"フレーム {frame_id} の推論に失敗しました。")
+                landmarks, handedness, inferred, static = None, None, False, False
+            elapsed = time.perf_counter() - start
+            result_queue.put(('result', (slot, frame_id, landmarks, handedness, inferred, static, elapsed)))
+    finally:
+        for shm in slots:
+            shm.close()
+
+class InferenceProcessPool:
+    """MediaPipe Hands を複数のワーカープロセスで動かす推論バックエンド
+
+    フレームは共有メモリのスロットに書き込んで渡し (pickle しない)、結果はランドマーク配列
+    (手の数, 21, 3) と利き手配列だけを受け取って FramePacket.hands (HandLandmarks) に入れる。
+    結果はフレーム番号順に並べ直して get() で返す。
+    source() は FramePacket (取得できなければ None) を返す関数で、空きスロットができるたびに
+    呼ばれるので、常にその時点の最新フレームが推論に回る。
+    各ワーカーは一部のフレームしか見ないため、MediaPipe のトラッキングはワーカーごとに行われる。
+    result_timeout 秒以内に結果が届かないフレーム (ワーカーの異常終了など) は失敗として捨て、
+    後続のフレームの出力を止めない。全ワーカーが終了した場合はプールを停止する。
+    """
+    def __init__(self, source, frame_shape, num_workers=2, slots_per_worker=2,
+                 output_queue_size=1, hands_kwargs=None, result_timeout=5.0, drop_policy="drop_oldest"):
+        self.source = source
+        self.frame_shape = tuple(frame_shape)
+        self.num_workers = num_workers
+        self.hands_kwargs = hands_kwargs or {}
+        self.result_timeout = result_timeout
+        frame_bytes = int(np.prod(self.frame_shape))
+
+        # 同時に推論中にできるフレーム数
+        self.num_slots = num_workers * slots_per_worker
+        self._slots = [shared_memory.SharedMemory(create=True, size=frame_bytes)
+                       for _ in range(self.num_slots)]
+        self._slot_views = [np.ndarray(self.frame_shape, dtype=np.uint8, buffer=shm.buf)
+                            for shm in self._slots]
+        self._free_slots = queue.Queue()
+        for slot in range(len(self._slots)):
+            self._free_slots.put(slot)
+
+        ctx = mp.get_context("spawn")
+        self._task_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+        self._workers = [
+            ctx.Process(target=_worker_main, name=f"inference-{i}", daemon=True,
+                        args=(self._task_queue, self._result_queue,
+                              [shm.name for shm in self._slots], self.hands_kwargs))
+            for i in range(num_workers)
+        ]
+
+        # 投入順 (= フレーム番号順) の未完了フレーム (パケット, スロット, 結果の期限)
+        self._pending = collections.deque()
+        self._pending_lock = threading.Lock()
+        # block なら取り出されるまで結果を待たせ、推論済みのフレームを捨てない
+        self._output = LatestValueQueue(output_queue_size, drop_policy)
+
+        self.stopped = False
+        self._workers_started = False
+        self.threads = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._worker_time = 0.0
+
+    def start_workers(self, timeout=30.0):
+        """ワーカーを起動し、全ワーカーのモデル読み込み完了を待つ"""
+        if self._workers_started:
+            return self
+        self._workers_started = True
+        for worker in self._workers:
+            worker.start()
+        deadline = time.perf_counter() + timeout
+        ready = 0
+        while ready < self.num_workers:
+            try:
+                kind, _ = self._result_queue.get(timeout=max(deadline - time.perf_counter(), 0.01))
+            except queue.Empty:
+                self.stop()
+                raise RuntimeError(f"{timeout}秒以内に推論ワーカーが起動しませんでした。")
+            if kind == 'ready':
+                ready += 1
+        return self
+
+    def start(self, timeout=30.0):
+        """(未起動なら) ワーカーを起動し、フレームの投入と結果の受け取りを開始する"""
+        self.stopped = False
+        self.start_workers(timeout)
+        self.threads = [
+            threading.Thread(target=self._run_feeder, name="inference-feeder", daemon=True),
+            threading.Thread(target=self._run_collector, name="inference-collector", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _run_feeder(self):
+        while not self.stopped:
+            # 空きスロットを確保してから最新フレームを読む
+            try:
+                slot = self._free_slots.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            packet = None
+            while packet is None and not self.stopped:
+                packet = self.source()
+            if packet is None:
+                self._free_slots.put(slot)
+                break
+            frame = packet.frame
+            if frame.shape != self.frame_shape:
+                logging.error(f"フレームの形状 {frame.shape} が共有メモリの形状 {self.frame_shape} と一致しません。")
+                self._free_slots.put(slot)
+                continue
+            np.copyto(self._slot_views[slot], frame)
+            with self._pending_lock:
+                self._pending.append((packet, slot, time.perf_counter() + self.result_timeout))
+            self._task_queue.put((slot, packet.frame_id, frame.shape))
+            self.submitted += 1
+
+    def _run_collector(self):
+        by_id = {}
+        abandoned = set()  # 期限切れで捨てたフレーム (遅れて届いた結果は無視する)
+        dead_workers = set()
+        while not self.stopped:
+            try:
+                kind, payload = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.stopped:
+                    # stop() でワーカーを終了させた場合は異常ではない
+                    break
+                kind = None
+                for worker in self._workers:
+                    if not worker.is_alive() and worker.name not in dead_workers:
+                        dead_workers.add(worker.name)
+                        logging.error(f"推論ワーカー {worker.name} が終了しました (終了コード {worker.exitcode})。")
+                if len(dead_workers) == len(self._workers):
+                    logging.error("すべての推論ワーカーが終了したため、推論を停止します。")
+                    self.stopped = True
+                    self._output.close()
+                    break
+            if kind == 'result':
+                slot, frame_id, landmarks, handedness, inferred, static, elapsed = payload
+                if frame_id in abandoned:
+                    # スロットは期限切れの時点で解放済み
+                    abandoned.discard(frame_id)
+                    continue
+                self._free_slots.put(slot)
+                self._worker_time += elapsed
+                by_id[frame_id] = (landmarks, handedness, inferred, static)
+            self._release_ready(by_id, abandoned)
+
+    def _release_ready(self, by_id, abandoned):
+        """先頭から順に、結果が揃ったフレームを出力し、期限を過ぎたフレームは失敗として捨てる"""
+        now = time.perf_counter()
+        with self._pending_lock:
+            while self._pending:
+                packet, slot, deadline = self._pending[0]
+                if packet.frame_id in by_id:
+                    self._pending.popleft()
+                    landmarks, handedness, inferred, static = by_id.pop(packet.frame_id)
+                    if landmarks is None:
+                        self.failed += 1
+                        continue
+                    packet.hands = HandLandmarks(landmarks, handedness)
+                    packet.inferred = inferred
+                    packet.static = static
+                    self.completed += 1
+                    self._output.put(packet)
+                elif now >= deadline:
+                    self._pending.popleft()
+                    logging.warning(f"フレーム {packet.frame_id} の推論結果が {self.result_timeout} 秒以内に届かないため、破棄します。")
+                    abandoned.add(packet.frame_id)
+                    self._free_slots.put(slot)
+                    self.failed += 1
+                else:
+                    break
+
+    def get(self, timeout=None):
+        """フレーム番号順に、推論済みの FramePacket を返す (なければ None)"""
+        return self._output.get(timeout)
+
+    def stop(self):
+        self.stopped = True
+        self._output.close()
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join(timeout=1.0)
+        for worker in self._workers:
+            if not self._workers_started:
+                break
+            worker.join(timeout=2.0)
+            if worker.is_alive():
+                worker.terminate()
+        self._slot_views = []
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
+
+    def get_stats(self):
+        """投入・完了・失敗フレーム数とワーカーの平均推論時間 (ms) を返す"""
+        finished = self.completed + self.failed
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'dropped': self._output.dropped,
+            'avg_worker_ms': self._worker_time / finished * 1000 if finished else 0.0,
+        }
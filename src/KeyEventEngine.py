@@ -0,0 +1,181 @@
+import numpy as np
+
+class KeyEvent:
+    """キー入力イベント (kind は "press" / "release" / "repeat")"""
+    __slots__ = ('timestamp', 'kind', 'keycode', 'key_index', 'hand', 'tip_id')
+
+    def __init__(self, timestamp, kind, keycode, key_index, hand, tip_id):
+        self.timestamp = timestamp  # フレームの取得時刻 (time.perf_counter)
+        self.kind = kind
+        self.keycode = keycode
+        self.key_index = key_index
+        self.hand = hand
+        self.tip_id = tip_id
+
+    def __repr__(self):
+        return (f"KeyEvent({self.timestamp:.3f}, {self.kind}, {self.keycode}, "
+                f"hand={self.hand}, tip_id={self.tip_id})")
+
+class _FingerState:
+    """1本の指の状態"""
+    __slots__ = ('candidate', 'candidate_since', 'z_baseline', 'pressed_key', 'next_repeat',
+                 'leaving_since', 'released_at')
+
+    def __init__(self):
+        self.candidate = -1          # 現在乗っているキー (押下前)
+        self.candidate_since = 0.0
+        self.z_baseline = None       # 深度判定用の z の基準値
+        self.pressed_key = -1        # 押下中のキー (-1 なら押していない)
+        self.next_repeat = None
+        self.leaving_since = None    # 押下中のキーから離れ始めた時刻
+        self.released_at = -np.inf
+
+class KeyEventEngine:
+    """KeyboardMapper のキー判定結果から、指ごとの状態機械で press / release / repeat を生成する
+
+    press_mode:
+      - "dwell": 同じキーに dwell_time 秒とどまったら押下
+      - "depth": 指先の z (画素単位。大きいほどカメラから遠い) が、
+                 キーに乗った時の基準値から depth_threshold [px] 以上深くなったら押下
+    押下中のキーから release_debounce 秒以上離れたら (depth では浅く戻ったら) 解放する。
+    解放後 debounce 秒は同じ指の押下を受け付けない。押下が repeat_delay 秒続くと
+    repeat_interval 秒ごとに repeat を出す (repeat_delay=None で無効)。
+    指ごとに独立して判定するので、10本すべての同時押し (N キーロールオーバー) に対応する。
+    dwell では、キーの割り当てが変わらず次の期限 (押下・リピート・解放) 前のフレームは
+    指ごとの処理を行わないので、処理量はフレームレートではなく状態変化の数に比例する。
+    """
+    PRESS_MODES = ("dwell", "depth")
+
+    def __init__(self, keyboard, press_mode="dwell", dwell_time=0.35, depth_threshold=12.0,
+                 debounce=0.08, release_debounce=0.05, repeat_delay=0.6, repeat_interval=0.1):
+        if press_mode not in self.PRESS_MODES:
+            raise ValueError(f"不明な press_mode です: {press_mode}")
+        self.keyboard = keyboard
+        self.press_mode = press_mode
+        self.dwell_time = dwell_time
+        self.depth_threshold = depth_threshold
+        self.debounce = debounce
+        self.release_debounce = release_debounce
+        self.repeat_delay = repeat_delay
+        self.repeat_interval = repeat_interval
+
+        self._fingers = {}  # (手のラベル, tip_id) -> _FingerState
+        self._signature = None
+        self._next_deadline = np.inf
+
+    @staticmethod
+    def collect_fingers(hands):
+        """HandLandmarks から (手のラベル, tip_id) のリストと指先 z の配列を作る"""
+        if hands is None:
+            return [], np.empty(0, dtype=np.float32)
+        labels = hands.labels()
+        finger_ids = [(labels[hand_index], tip_id) for hand_index, tip_id in hands.fingertip_owners()]
+        return finger_ids, hands.fingertip_depths()
+
+    def update(self, timestamp, hands, key_indices):
+        """1フレーム分の指とキーの対応を入力し、発生した KeyEvent のリストを返す
+
+        key_indices は hands.fingertips() と同じ順の、各指先のキー番号 (-1 はキー外)。
+        """
+        finger_ids, z_values = self.collect_fingers(hands)
+        key_indices = np.asarray(key_indices, dtype=np.intp)
+
+        signature = (tuple(finger_ids), key_indices.tobytes())
+        if (self.press_mode == "dwell" and signature == self._signature
+                and timestamp < self._next_deadline):
+            return []
+        self._signature = signature
+
+        events = []
+        present = set()
+        for finger_id, key, z in zip(finger_ids, key_indices.tolist(), z_values.tolist()):
+            present.add(finger_id)
+            state = self._fingers.get(finger_id)
+            if state is None:
+                state = self._fingers[finger_id] = _FingerState()
+            self._step(state, finger_id, key, z, timestamp, events)
+
+        # 見えなくなった指はキーから離れたものとして扱う
+        for finger_id in [finger_id for finger_id in self._fingers if finger_id not in present]:
+            state = self._fingers[finger_id]
+            if state.pressed_key >= 0:
+                self._step(state, finger_id, -1, None, timestamp, events)
+            if state.pressed_key < 0:
+                del self._fingers[finger_id]
+
+        self._next_deadline = self._compute_deadline()
+        return events
+
+    def _step(self, state, finger_id, key, z, now, events):
+        if state.pressed_key >= 0:
+            still_pressed = key == state.pressed_key
+            if still_pressed and self.press_mode == "depth" and z is not None:
+                # 押し込みの半分より浅く戻ったら解放 (ヒステリシス)
+                still_pressed = z - state.z_baseline >= self.depth_threshold * 0.5
+            if still_pressed:
+                state.leaving_since = None
+                if state.next_repeat is not None and now >= state.next_repeat:
+                    events.append(self._event(now, "repeat", state.pressed_key, finger_id))
+                    state.next_repeat = now + self.repeat_interval
+                return
+            if state.leaving_since is None:
+                state.leaving_since = now
+            if now - state.leaving_since < self.release_debounce:
+                return
+            events.append(self._event(now, "release", state.pressed_key, finger_id))
+            state.pressed_key = -1
+            state.next_repeat = None
+            state.leaving_since = None
+            state.released_at = now
+            state.candidate = -1
+
+        if key != state.candidate:
+            state.candidate = key
+            state.candidate_since = now
+            state.z_baseline = z
+            return
+        if key < 0 or now - state.released_at < self.debounce:
+            return
+
+        if self.press_mode == "dwell":
+            pressed = now - state.candidate_since >= self.dwell_time
+        else:
+            if z is None or state.z_baseline is None:
+                return
+            pressed = z - state.z_baseline >= self.depth_threshold
+            if not pressed:
+                # 手の高さのゆっくりした変化に追従するよう基準値を更新する
+                state.z_baseline = min(state.z_baseline, z) * 0.9 + z * 0.1
+        if pressed:
+            state.pressed_key = key
+            state.leaving_since = None
+            if self.repeat_delay is not None:
+                state.next_repeat = now + self.repeat_delay
+            events.append(self._event(now, "press", key, finger_id))
+
+    def _compute_deadline(self):
+        """何も変化しなくても状態が変わりうる最も早い時刻 (dwell の早期終了判定用)"""
+        deadline = np.inf
+        for state in self._fingers.values():
+            if state.pressed_key >= 0:
+                if state.leaving_since is not None:
+                    deadline = min(deadline, state.leaving_since + self.release_debounce)
+                if state.next_repeat is not None:
+                    deadline = min(deadline, state.next_repeat)
+            elif state.candidate >= 0:
+                deadline = min(deadline, max(state.candidate_since + self.dwell_time,
+                                             state.released_at + self.debounce))
+        return deadline
+
+    def _event(self, timestamp, kind, key_index, finger_id):
+        hand, tip_id = finger_id
+        return KeyEvent(timestamp, kind, self.keyboard.keys[key_index].keycode, key_index, hand, tip_id)
+
+    def release_all(self, timestamp):
+        """押下中のキーをすべて解放するイベントを返す (終了時など)"""
+        events = [self._event(timestamp, "release", state.pressed_key, finger_id)
+                  for finger_id, state in self._fingers.items() if state.pressed_key >= 0]
+        self._fingers.clear()
+        self._signature = None
+        self._next_deadline = np.inf
+        return events
@@ -1,9 +1,18 @@
 import numpy as np
 import cv2
+from HandLandmarks import FINGER_TIPS
 class KeyboardMapper:
-    def __init__(self, keyboard, camera_corners):
+    def __init__(self, keyboard, camera_corners, frame_size=None, show_key_labels=False, finger_log=None):
         self.keyboard = keyboard
         self.camera_corners = np.array(camera_corners, dtype=np.float32)
+        # (幅, 高さ)。指定されていればカメラ画素 -> キー番号 のラスタを作成する
+        self.frame_size = frame_size
+        self.key_raster = None
+        # 静的オーバーレイ (フレーム形状, BGR画像, マスク) のキャッシュ
+        self.show_key_labels = show_key_labels
+        self._overlay = None
+        # 指とキーの対応の出力先 (OutputSink.AsyncLogWriter)。None なら出力しない
+        self.finger_log = finger_log
         
         # # キーボードの正規化座標での4角
         # self.keyboard_corners = np.array([
@@ -13,6 +22,10 @@ class KeyboardMapper:
         #     [0.0, 1.0]       # 左下
         # ], dtype=np.float32)
 
+        self._update_geometry()
+
+    def _update_geometry(self):
+        """キーマップ・4角から決まる変換行列・キーテーブル・ラスタを作り直す"""
         # キーボードの正規化座標での4角（幅基準の正規化）
         # keymap2coordinate.py の normalize() の仕様に合わせる
         keyboard_h_normalized = self.keyboard.height / self.keyboard.width
@@ -23,15 +36,105 @@ class KeyboardMapper:
             [0.0, keyboard_h_normalized]     # 左下
         ], dtype=np.float32)
         
-        # # ホモグラフィ行列を計算
-        # self.homography_matrix = cv2.getPerspectiveTransform(
-        #     self.keyboard_corners, self.camera_corners
-        # )
+        # キーボード正規化座標 -> カメラ座標 への変換行列
+        self.homography_matrix = cv2.getPerspectiveTransform(
+            self.keyboard_norm_corners, self.camera_corners
+        )
 
         # カメラ座標 -> キーボード正規化座標 への変換行列
         self.inv_homography_matrix = cv2.getPerspectiveTransform(
             self.camera_corners, self.keyboard_norm_corners
         )
+
+        self._build_key_table()
+        self.key_quads = self._project_key_quads()
+        # 描画用に整数化した各キーの4角 (cv2.polylines 形式)
+        self.key_quads_px = np.round(self.key_quads).astype(np.int32).reshape(-1, 4, 1, 2)
+
+        self._overlay = None
+        self.key_raster = None
+        if self.frame_size is not None:
+            self._build_key_raster()
+
+    def set_camera_corners(self, camera_corners):
+        """カメラ上のキーボード4角を変更する"""
+        self.camera_corners = np.array(camera_corners, dtype=np.float32)
+        self._update_geometry()
+
+    def set_keyboard(self, keyboard):
+        """キーマップを差し替える"""
+        self.keyboard = keyboard
+        self._update_geometry()
+
+    def set_frame_size(self, width, height):
+        """カメラ画像の解像度を設定し、キー番号ラスタを作成する"""
+        if self.frame_size == (width, height) and self.key_raster is not None:
+            return
+        self.frame_size = (width, height)
+        self._build_key_raster()
+
+    def _build_key_table(self):
+        """キー配列を NumPy の列 (左端, 上端, 右端, 下端) に展開する"""
+        keys = self.keyboard.keys
+        # get_key_for_point の判定 (x <= nx < x + width) と同じ値になるよう float64 で保持
+        x = np.array([key.x for key in keys], dtype=np.float64)
+        y = np.array([key.y for key in keys], dtype=np.float64)
+        w = np.array([key.width for key in keys], dtype=np.float64)
+        h = np.array([key.height for key in keys], dtype=np.float64)
+        self.key_x0 = x
+        self.key_y0 = y
+        self.key_x1 = x + w
+        self.key_y1 = y + h
+
+    def _build_key_raster(self):
+        """各画素に乗っているキーの番号 (なしは -1) を持つラスタをカメラ解像度で作成する"""
+        width, height = self.frame_size
+        num_keys = len(self.key_x0)
+        dtype = np.int16 if num_keys < np.iinfo(np.int16).max else np.int32
+        raster = np.full((height, width), -1, dtype=dtype)
+
+        if num_keys > 0 and width > 0 and height > 0:
+            # 全画素の正規化座標を一度だけ計算
+            xs, ys = np.meshgrid(np.arange(width, dtype=np.float32),
+                                 np.arange(height, dtype=np.float32))
+            pixels = np.dstack((xs, ys)).reshape(-1, 1, 2)
+            norm = cv2.perspectiveTransform(pixels, self.inv_homography_matrix).reshape(height, width, 2)
+            norm_x = norm[..., 0]
+            norm_y = norm[..., 1]
+
+            # 各キーの4角をカメラ座標に射影し、外接矩形の範囲だけ判定する
+            quads = self.key_quads
+            # 重なったキーは keys の先頭に近いものを優先するため、逆順に書き込む
+            for i in range(num_keys - 1, -1, -1):
+                quad = quads[i]
+                if not np.all(np.isfinite(quad)):
+                    continue
+                x0 = max(int(np.floor(quad[:, 0].min())) - 1, 0)
+                y0 = max(int(np.floor(quad[:, 1].min())) - 1, 0)
+                x1 = min(int(np.ceil(quad[:, 0].max())) + 2, width)
+                y1 = min(int(np.ceil(quad[:, 1].max())) + 2, height)
+                if x0 >= x1 or y0 >= y1:
+                    continue
+                nx = norm_x[y0:y1, x0:x1]
+                ny = norm_y[y0:y1, x0:x1]
+                inside = ((self.key_x0[i] <= nx) & (nx < self.key_x1[i]) &
+                          (self.key_y0[i] <= ny) & (ny < self.key_y1[i]))
+                raster[y0:y1, x0:x1][inside] = i
+
+        self.key_raster = raster
+
+    def _project_key_quads(self):
+        """全キーの4角 (左上, 右上, 右下, 左下) をカメラ座標に射影した (K, 4, 2) 配列を返す"""
+        corners = np.stack([
+            np.stack([self.key_x0, self.key_y0], axis=1),
+            np.stack([self.key_x1, self.key_y0], axis=1),
+            np.stack([self.key_x1, self.key_y1], axis=1),
+            np.stack([self.key_x0, self.key_y1], axis=1),
+        ], axis=1).astype(np.float32)
+        if len(corners) == 0:
+            return corners
+        projected = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), self.homography_matrix)
+        return projected.reshape(-1, 4, 2)
     
     # def transform_point(self, x, y):
     #     """正規化座標をカメラ座標に変換"""
@@ -45,52 +148,97 @@ class KeyboardMapper:
         transformed = cv2.perspectiveTransform(point, self.inv_homography_matrix)
         return transformed[0][0]
     
+    def _transform_cam_to_norm_batch(self, points):
+        """カメラ座標の点群 (N, 2) を一度のホモグラフィ変換で正規化座標 (N, 2) に変換"""
+        pts = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        if len(pts) == 0:
+            return np.empty((0, 2), dtype=np.float32)
+        transformed = cv2.perspectiveTransform(pts, self.inv_homography_matrix)
+        return transformed.reshape(-1, 2)
+
+    def get_key_indices_for_points(self, points):
+        """カメラ座標の点群 (N, 2) それぞれが乗っているキーの番号 (N,) を返す (該当なしは -1)"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if self.key_raster is None:
+            return self._lookup_key_indices(points)
+
+        # ラスタ内の点は画素参照のみで判定し、画面外の点だけ射影変換で判定する
+        height, width = self.key_raster.shape
+        xi = np.floor(points[:, 0]).astype(np.intp)
+        yi = np.floor(points[:, 1]).astype(np.intp)
+        in_frame = (0 <= xi) & (xi < width) & (0 <= yi) & (yi < height)
+        indices = np.empty(len(points), dtype=np.intp)
+        indices[in_frame] = self.key_raster[yi[in_frame], xi[in_frame]]
+        if not in_frame.all():
+            indices[~in_frame] = self._lookup_key_indices(points[~in_frame])
+        return indices
+
+    def _lookup_key_indices(self, points):
+        """射影変換とキーテーブルの一括比較でキー番号を求める"""
+        norm = self._transform_cam_to_norm_batch(points)
+        nx = norm[:, 0:1]
+        ny = norm[:, 1:2]
+        # (N, K) の当たり判定を一度に計算
+        hit = (self.key_x0 <= nx) & (nx < self.key_x1) & (self.key_y0 <= ny) & (ny < self.key_y1)
+        if hit.shape[1] == 0:
+            return np.full(len(norm), -1, dtype=np.intp)
+        # 従来のループと同じく、重なっている場合は keys の先頭に近いキーを採用
+        indices = hit.argmax(axis=1)
+        indices[~hit.any(axis=1)] = -1
+        return indices
+
+    def get_keys_for_points(self, points):
+        """カメラ座標の点群 (N, 2) それぞれが乗っているキーオブジェクト (またはNone) のリストを返す"""
+        keys = self.keyboard.keys
+        return [keys[i] if i >= 0 else None for i in self.get_key_indices_for_points(points)]
+
     def get_key_for_point(self, px, py):
         """カメラ座標(px, py)上にあるキーオブジェクトを返す"""
-        nx, ny = self._transform_cam_to_norm(px, py)
-        
-        for key in self.keyboard.keys:
-            if key.x <= nx < key.x + key.width and key.y <= ny < key.y + key.height:
-                return key
-        return None
-    
-    def draw_keyboard_and_finger_info(self, frame, finger_positions=None):
-        """キーボードの枠線を描画し、指とキーのマッピング情報を描画・出力する"""
-        
-        # --- 1. キーボードの枠線を描画 ---
+        return self.get_keys_for_points([[px, py]])[0]
+
+    def _build_overlay(self, frame_shape):
+        """キーボード枠線・キー枠・(任意で)キー名を描いた静的オーバーレイとマスクを作成する"""
+        height, width = frame_shape[:2]
+        overlay = np.zeros((height, width, 3), dtype=np.uint8)
+
+        # --- キーボードの枠線 ---
         pts = self.camera_corners.astype(np.int32).reshape((-1, 1, 2))
-        cv2.polylines(frame, [pts], True, (255, 255, 0), 1)
-
-        # 各キーを描画
-        for key in self.keyboard.keys:
-            # キーの4角を変換
-            top_left = self._transform_cam_to_norm(key.x, key.y)
-            top_right = self._transform_cam_to_norm(key.x + key.width, key.y)
-            bottom_right = self._transform_cam_to_norm(key.x + key.width, key.y + key.height)
-            bottom_left = self._transform_cam_to_norm(key.x, key.y + key.height)
-            
-            top_left = (10,10)
-            top_right = (20,10)
-            bottom_left = (10,20)
-            bottom_right = (20,20)
-            # キーの枠色を決定
-            color = (0, 0, 255)  # デフォルトは赤
-            
-            # # 人差し指がキー内にあるかチェック
-            # for finger_x, finger_y in index_fingers:
-            #     if self.is_point_in_key(finger_x, finger_y, key):
-            #         color = (0, 255, 0)  # 緑
-            #         break
-            
-            # キーを描画（ポリゴンとして描画）
-            pts = np.array([top_left, top_right, bottom_right, bottom_left], np.int32)
-            pts = pts.reshape((-1, 1, 2))
-            cv2.polylines(frame, [pts], True, color, 1)
+        cv2.polylines(overlay, [pts], True, (255, 255, 0), 1)
 
-        if not finger_positions:
+        # --- 各キーの枠 (デフォルトは赤) ---
+        cv2.polylines(overlay, list(self.key_quads_px), True, (0, 0, 255), 1)
+
+        if self.show_key_labels:
+            for key, quad in zip(self.keyboard.keys, self.key_quads_px):
+                center_x, center_y = quad.reshape(-1, 2).mean(axis=0).astype(int)
+                cv2.putText(overlay, key.keycode, (center_x - 10, center_y + 5),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1, cv2.LINE_AA)
+
+        # 描画された画素だけをフレームにコピーするためのマスク
+        mask = overlay.any(axis=2).astype(np.uint8)
+        self._overlay = (frame_shape[:2], overlay, mask)
+
+    def draw_keyboard(self, frame):
+        """キャッシュ済みの静的オーバーレイをフレームに合成する"""
+        if self._overlay is None or self._overlay[0] != frame.shape[:2]:
+            self._build_overlay(frame.shape)
+        _, overlay, mask = self._overlay
+        cv2.copyTo(overlay, mask, frame)
+
+    def draw_keyboard_and_finger_info(self, frame, hands=None, key_indices=None):
+        """キーボードの枠線を描画し、指とキーのマッピング情報を描画・出力する
+
+        key_indices に get_key_indices_for_points の結果を渡すと、判定をやり直さずに描画する。
+        出力は finger_log に1フレーム1件で積むだけなので、描画スレッドは書き込みを待たない。
+        """
+        
+        # --- 1. キーボードの枠線と各キーを描画 (静的部分はキャッシュから合成) ---
+        self.draw_keyboard(frame)
+
+        if not hands:
             return
 
-        # --- 2. 各指がどのキー上にあるか判定し、描画とコンソール出力 ---
+        # --- 2. 各指がどのキー上にあるか判定し、描画と出力 ---
         finger_names = {
             4: "Thumb", 8: "Index", 12: "Middle", 16: "Ring", 20: "Pinky"
         }
@@ -99,23 +247,36 @@ class KeyboardMapper:
         # import os
         # os.system('cls' if os.name == 'nt' else 'clear')
 
-        for hand in finger_positions:
-            hand_label = hand['label']
-            print(f"--- {hand_label} Hand ---")
+        # 全ての指先を一括で判定
+        if key_indices is None:
+            key_indices = self.get_key_indices_for_points(hands.fingertips())
+        keys = self.keyboard.keys
+        finger_keys = iter([keys[i] if i >= 0 else None for i in key_indices])
+
+        # 指が乗っているキーのみ毎フレーム緑で描画
+        hovered = np.unique(key_indices[key_indices >= 0])
+        if len(hovered) > 0:
+            cv2.polylines(frame, [self.key_quads_px[i] for i in hovered], True, (0, 255, 0), 1)
+
+        tips = hands.fingertips().astype(np.int32).reshape(len(hands), -1, 2).tolist()
+        lines = []
+        for hand_label, hand_tips in zip(hands.labels(), tips):
+            lines.append(f"--- {hand_label} Hand ---")
             
-            for tip_id, x, y in hand['fingers']:
-                key = self.get_key_for_point(x, y)
+            for tip_id, (x, y) in zip(FINGER_TIPS, hand_tips):
+                key = next(finger_keys)
                 finger_name = finger_names.get(tip_id, "Unknown")
 
                 if key:
-                    # コンソールに出力
-                    print(f"  {finger_name.ljust(6)}: {key.keycode}")
+                    lines.append(f"  {finger_name.ljust(6)}: {key.keycode}")
 
                     # 画面に描画
                     text = f"{finger_name}: {key.keycode}"
                     cv2.putText(frame, text, (x, y - 10), 
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv2.LINE_AA)
-        print("--------------------")
+        if self.finger_log is not None:
+            lines.append("--------------------")
+            self.finger_log.emit("\n".join(lines), key="fingers")
     
     # def is_point_in_key(self, px, py, key):
     #     """点がキー内にあるかチェック"""
@@ -0,0 +1,96 @@
+import numpy as np
+
+from HandLandmarks import HandLandmarks
+
+class LandmarkPredictor:
+    """推論結果のランドマークを One Euro フィルタで平滑化し、等速運動を仮定して任意の時刻に外挿する
+
+    全ての手・全21点・x/y/z を (手の数, 21, 3) の配列のまま一括で計算する。
+    推論を間引いたフレームや、推論後の処理の遅延分を predict() で補う。
+    手の対応付けは、利き手が同じで手首が最も近いもの同士で行う。
+    """
+    def __init__(self, min_cutoff=1.5, beta=0.02, derivative_cutoff=1.0, max_extrapolation=0.1):
+        # 静止時の平滑化の強さ [Hz] (小さいほど強く平滑化する)
+        self.min_cutoff = min_cutoff
+        # 速度に応じて平滑化を弱める係数 [Hz / (px/s)] (大きいほど速い動きへの追従がよい)
+        self.beta = beta
+        self.derivative_cutoff = derivative_cutoff
+        # 外挿する時間の上限 [s] (推論が途切れた時に位置が飛んでいかないように)
+        self.max_extrapolation = max_extrapolation
+
+        self._position = None    # 平滑化した位置 (手の数, 21, 3)
+        self._velocity = None    # 平滑化した速度 [px/s]
+        self._handedness = None
+        self._timestamp = None
+        self.updates = 0
+        self.predictions = 0
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * np.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def _match(self, hands):
+        """新しい各手に対応する前回の手の番号 (なければ -1) を返す"""
+        order = np.full(len(hands), -1, dtype=np.intp)
+        if self._position is None or len(self._position) == 0:
+            return order
+        distance = np.linalg.norm(hands.landmarks[:, None, 0, :2] - self._position[None, :, 0, :2], axis=2)
+        distance[hands.handedness[:, None] != self._handedness[None, :]] = np.inf
+        used = set()
+        for flat_index in np.argsort(distance, axis=None).tolist():
+            new_index, old_index = divmod(flat_index, distance.shape[1])
+            if not np.isfinite(distance[new_index, old_index]):
+                break
+            if order[new_index] < 0 and old_index not in used:
+                order[new_index] = old_index
+                used.add(old_index)
+        return order
+
+    def update(self, hands, timestamp):
+        """timestamp (キャプチャ時刻) のフレームで推論した HandLandmarks を取り込む"""
+        self.updates += 1
+        measured = hands.landmarks
+        dt = None if self._timestamp is None else timestamp - self._timestamp
+        order = self._match(hands)
+        if dt is None or dt <= 0 or not (order >= 0).any():
+            self._position = measured.copy()
+            self._velocity = np.zeros_like(measured)
+        else:
+            matched = order >= 0
+            previous = measured.copy()
+            previous_velocity = np.zeros_like(measured)
+            previous[matched] = self._position[order[matched]]
+            previous_velocity[matched] = self._velocity[order[matched]]
+
+            raw_velocity = (measured - previous) / dt
+            self._velocity = previous_velocity + self._alpha(self.derivative_cutoff, dt) * (raw_velocity - previous_velocity)
+            cutoff = self.min_cutoff + self.beta * np.abs(self._velocity)
+            self._position = previous + self._alpha(cutoff, dt) * (measured - previous)
+            # 新しく現れた手は速度 0 から始める
+            self._velocity[~matched] = 0.0
+        self._handedness = hands.handedness.copy()
+        self._timestamp = timestamp
+
+    def update_static(self, hands, timestamp):
+        """動きがないと分かっているフレーム: 直前の推論結果を timestamp の観測として取り込み、速度を 0 にする
+
+        推論を省いたフレームで最後の速度のまま外挿し続けると、止まった指の位置を行き過ぎてしまう。
+        """
+        self.update(hands, timestamp)
+        self._velocity[:] = 0.0
+
+    def predict(self, timestamp):
+        """timestamp の時点の位置を外挿した HandLandmarks を返す"""
+        if self._position is None or len(self._position) == 0:
+            return HandLandmarks.empty()
+        self.predictions += 1
+        dt = min(max(timestamp - self._timestamp, 0.0), self.max_extrapolation)
+        landmarks = self._position + self._velocity * np.float32(dt)
+        return HandLandmarks(landmarks.astype(np.float32, copy=False), self._handedness)
+
+    def reset(self):
+        self._position = None
+        self._velocity = None
+        self._handedness = None
+        self._timestamp = None
@@ -0,0 +1,60 @@
+import time
+
+import cv2
+
+# 縮小率 -> imdecode のフラグ (JPEG は DCT の段階で 1/2, 1/4, 1/8 に縮小して展開できる)
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+class MjpegDecoder:
+    """カメラから受け取った MJPG のバイト列 (CAP_PROP_CONVERT_RGB = 0) を BGR 画像に展開する
+
+    推論にしか使わないフレームは推論解像度に足りる範囲で縮小して展開し、
+    全解像度の展開は表示するフレームだけにする。
+    """
+    def __init__(self, max_reduction=4):
+        self.max_reduction = max_reduction
+        self.full_decodes = 0
+        self.reduced_decodes = 0
+        self.failed = 0
+        self.decode_time = 0.0
+
+    @staticmethod
+    def is_encoded(frame):
+        """frame が展開前の JPEG バイト列 (1次元または 1 行の uint8 配列) か"""
+        return frame.ndim == 1 or (frame.ndim == 2 and frame.shape[0] == 1)
+
+    def reduction_for(self, scale):
+        """全解像度に対して scale 倍の画像が得られる最大の縮小率 (1, 2, 4, 8) を返す"""
+        reduction = 1
+        while reduction * 2 <= self.max_reduction and scale * reduction * 2 <= 1.0 + 1e-6:
+            reduction *= 2
+        return reduction
+
+    def decode(self, buffer, reduction=1):
+        """JPEG を 1/reduction の大きさで展開する (壊れたフレームなら None)"""
+        start = time.perf_counter()
+        frame = cv2.imdecode(buffer.reshape(-1), REDUCED_FLAGS[reduction])
+        self.decode_time += time.perf_counter() - start
+        if frame is None:
+            self.failed += 1
+            return None
+        if reduction == 1:
+            self.full_decodes += 1
+        else:
+            self.reduced_decodes += 1
+        return frame
+
+    def get_stats(self):
+        """展開回数と1回あたりの平均展開時間 [ms] を返す"""
+        decodes = self.full_decodes + self.reduced_decodes
+        return {
+            'full': self.full_decodes,
+            'reduced': self.reduced_decodes,
+            'failed': self.failed,
+            'avg_ms': self.decode_time / decodes * 1000 if decodes else 0.0,
+        }
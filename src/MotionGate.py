@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+
+class MotionGate:
+    """キーボード周辺の縮小グレースケール画像のフレーム差分から、推論が必要かどうかを判定する
+
+    差分は最後に推論したフレームと比べるので、ゆっくりした動きも積み重なれば検出される。
+    動きを検出したフレームでは即座に推論するため、動き始めの遅延は増えない。
+    """
+    def __init__(self, region=None, size=(80, 45), pixel_threshold=12, motion_threshold=0.005,
+                 max_skip_frames=30):
+        # 判定する領域 (x0, y0, x1, y1)。None ならフレーム全体
+        self.region = region
+        self.size = size
+        # 画素値の差がこれを超えた画素を「動いた」とみなす
+        self.pixel_threshold = pixel_threshold
+        # 動いた画素の割合がこれ未満なら静止とみなす
+        self.motion_threshold = motion_threshold
+        # 静止が続いても、この回数ごとに一度は推論する (トラッキングの維持のため)
+        self.max_skip_frames = max_skip_frames
+
+        self._reference = None
+        self._skipped_in_row = 0
+        self.motion_ratio = 0.0
+        self.inferred = 0
+        self.skipped = 0
+
+    def _thumbnail(self, frame, scale=1.0):
+        if self.region is not None:
+            height, width = frame.shape[:2]
+            x0, y0, x1, y1 = (int(round(v * scale)) for v in self.region)
+            frame = frame[max(y0, 0):min(y1, height), max(x0, 0):min(x1, width)]
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def needs_inference(self, frame, scale=1.0):
+        """このフレームで推論すべきなら True を返す (True の場合はこのフレームを次の比較基準にする)
+
+        scale は全解像度に対する frame の倍率 (region は全解像度の座標のまま)。
+        """
+        thumbnail = self._thumbnail(frame, scale)
+        if self._reference is None or self._skipped_in_row >= self.max_skip_frames:
+            self.motion_ratio = 1.0
+        else:
+            diff = cv2.absdiff(thumbnail, self._reference)
+            self.motion_ratio = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+
+        if self.motion_ratio < self.motion_threshold:
+            self._skipped_in_row += 1
+            self.skipped += 1
+            return False
+
+        self._reference = thumbnail
+        self._skipped_in_row = 0
+        self.inferred += 1
+        return True
+
+    def reset(self):
+        """比較基準を捨て、次のフレームで必ず推論させる"""
+        self._reference = None
@@ -0,0 +1,160 @@
+import collections
+import queue
+import socket
+import sys
+import threading
+import time
+import logging
+
+class ConsoleSink:
+    """標準出力に書き出す"""
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def write_lines(self, lines):
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+class FileSink:
+    """ファイルに追記する"""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write_lines(self, lines):
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class SocketSink:
+    """TCP で送る。切断された場合は次の書き込みで接続し直し、その間の行は捨てる"""
+    def __init__(self, host, port, timeout=1.0):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = None
+
+    def write_lines(self, lines):
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            if self.sock is None:
+                self.sock = socket.create_connection(self.address, timeout=self.timeout)
+            self.sock.sendall(data)
+        except OSError as e:
+            logging.warning(f"出力先 {self.address[0]}:{self.address[1]} に送信できませんでした: {e}")
+            self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+class MemorySink:
+    """直近 maxlen 行をメモリに保持する (テストや画面表示用)"""
+    def __init__(self, maxlen=10000):
+        self.lines = collections.deque(maxlen=maxlen)
+
+    def write_lines(self, lines):
+        self.lines.extend(lines)
+
+    def close(self):
+        pass
+
+# create_sink() が受け付ける種類
+SINK_KINDS = ("console", "file", "tcp", "memory", "none")
+
+def parse_sink_spec(spec):
+    """"console" / "file:PATH" / "tcp:HOST:PORT" / "memory" / "none" を (種類, 引数) に分ける"""
+    kind, _, target = spec.partition(":")
+    if kind not in SINK_KINDS:
+        raise ValueError(f"不明な出力先です: {spec}")
+    if kind == "file" and not target:
+        raise ValueError("file にはパスを指定してください (例: file:PATH)")
+    if kind == "tcp" and not target.rpartition(":")[2].isdigit():
+        raise ValueError(f"tcp にはポート番号を指定してください (例: tcp:HOST:PORT): {spec}")
+    return kind, target
+
+def create_sink(spec):
+    """spec (parse_sink_spec の書式) から出力先を作る (none は None。ファイルを開けなければ OSError)"""
+    kind, target = parse_sink_spec(spec)
+    if kind == "console":
+        return ConsoleSink()
+    if kind == "file":
+        return FileSink(target)
+    if kind == "tcp":
+        host, _, port = target.rpartition(":")
+        return SocketSink(host or "localhost", int(port))
+    if kind == "memory":
+        return MemorySink()
+    return None
+
+class AsyncLogWriter:
+    """出力先への書き込みをバックグラウンドスレッドで行う
+
+    emit() はキューに積むだけでブロックしない (キューが満杯なら捨てて dropped に数える)。
+    key を付けた行 (毎フレームの状態表示など) は key ごとに、changes_only なら直前と同じ内容を
+    捨て、rate_limit [行/秒] を超える分を捨てる。key なしの行 (キーイベントなど) は常に出力する。
+    """
+    def __init__(self, sink, max_queue=1024, rate_limit=None, changes_only=False):
+        self.sink = sink
+        self.rate_limit = rate_limit
+        self.changes_only = changes_only
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._last_text = {}
+        self._last_time = {}
+        self.written = 0
+        self.dropped = 0
+        self.suppressed = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def emit(self, text, key=None):
+        """text を出力待ちに積む (呼び出し元は待たない)"""
+        if key is not None:
+            if self.changes_only and self._last_text.get(key) == text:
+                self.suppressed += 1
+                return
+            if self.rate_limit:
+                now = time.perf_counter()
+                if now - self._last_time.get(key, -float("inf")) < 1.0 / self.rate_limit:
+                    self.suppressed += 1
+                    return
+                self._last_time[key] = now
+            self._last_text[key] = text
+        try:
+            self._queue.put_nowait(text)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not self.stopped or not self._queue.empty():
+            try:
+                lines = [self._queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            # 溜まっている分をまとめて1回で書き出す
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.sink.write_lines(lines)
+                self.written += len(lines)
+            except Exception:
+                logging.exception("ログの書き出しに失敗しました。")
+
+    def close(self, timeout=2.0):
+        """残りを書き出してから出力先を閉じる"""
+        self.stopped = True
+        if self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+        self.sink.close()
@@ -0,0 +1,84 @@
+import time
+import logging
+
+# 品質レベル (上ほど高品質・高負荷)。inference_scale は起動時に指定した倍率に掛ける係数、
+# frame_skip は推論を省略して直前の結果を使い回すフレーム数 (1 なら2フレームに1回推論)
+QUALITY_LEVELS = (
+    {'inference_scale': 1.0,  'model_complexity': 1, 'max_num_hands': 2, 'frame_skip': 0},
+    {'inference_scale': 0.75, 'model_complexity': 1, 'max_num_hands': 2, 'frame_skip': 0},
+    {'inference_scale': 0.5,  'model_complexity': 1, 'max_num_hands': 2, 'frame_skip': 0},
+    {'inference_scale': 0.5,  'model_complexity': 0, 'max_num_hands': 2, 'frame_skip': 0},
+    {'inference_scale': 0.5,  'model_complexity': 0, 'max_num_hands': 2, 'frame_skip': 1},
+    {'inference_scale': 0.5,  'model_complexity': 0, 'max_num_hands': 1, 'frame_skip': 1},
+    {'inference_scale': 0.5,  'model_complexity': 0, 'max_num_hands': 1, 'frame_skip': 2},
+)
+
+class QualityController:
+    """フレーム取得からキー判定までの遅延を監視し、予算内に収まるよう品質レベルを上下させる
+
+    遅延の指数移動平均が予算を degrade_ratio 倍以上超えた状態が degrade_frames フレーム続くと
+    1段階下げ、upgrade_ratio 倍未満の状態が upgrade_frames フレーム続くと1段階上げる。
+    変更後 cooldown_frames フレームは次の変更をしない (ヒステリシス)。
+    """
+    def __init__(self, budget_ms=40.0, levels=QUALITY_LEVELS, initial_level=0, smoothing=0.1,
+                 degrade_ratio=1.0, upgrade_ratio=0.6, degrade_frames=10, upgrade_frames=90,
+                 cooldown_frames=30):
+        self.budget = budget_ms / 1000.0
+        self.levels = levels
+        self.level = initial_level
+        self.smoothing = smoothing
+        self.degrade_ratio = degrade_ratio
+        self.upgrade_ratio = upgrade_ratio
+        self.degrade_frames = degrade_frames
+        self.upgrade_frames = upgrade_frames
+        self.cooldown_frames = cooldown_frames
+
+        self.latency = None  # 遅延の指数移動平均 [s]
+        self._over = 0
+        self._under = 0
+        self._cooldown = 0
+        self.decisions = []  # (時刻, 旧レベル, 新レベル, 平均遅延[s], 理由)
+
+    @property
+    def settings(self):
+        """現在の品質レベルの設定"""
+        return self.levels[self.level]
+
+    def observe(self, latency):
+        """1フレーム分の遅延 [s] を記録する。品質レベルを変えた場合は新しい設定を返す (それ以外は None)"""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+
+        if self._cooldown > 0:
+            self._cooldown -= 1
+            return None
+
+        if self.latency > self.budget * self.degrade_ratio:
+            self._over += 1
+            self._under = 0
+        elif self.latency < self.budget * self.upgrade_ratio:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = 0
+            self._under = 0
+
+        if self._over >= self.degrade_frames and self.level < len(self.levels) - 1:
+            return self._change(self.level + 1, "予算超過")
+        if self._under >= self.upgrade_frames and self.level > 0:
+            return self._change(self.level - 1, "余裕あり")
+        return None
+
+    def _change(self, new_level, reason):
+        old_level = self.level
+        self.level = new_level
+        self._over = 0
+        self._under = 0
+        self._cooldown = self.cooldown_frames
+        self.decisions.append((time.time(), old_level, new_level, self.latency, reason))
+        logging.info(
+            f"品質レベル {old_level} -> {new_level} ({reason}: 平均遅延 {self.latency * 1000:.1f} ms / "
+            f"予算 {self.budget * 1000:.1f} ms): {self.settings}")
+        return self.settings
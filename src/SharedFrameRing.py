@@ -0,0 +1,156 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# スロットごとのヘッダ。frame_id が -1 の間は書き込み中
+SLOT_HEADER_DTYPE = np.dtype([
+    ('frame_id', '<i8'),
+    ('timestamp', '<f8'),
+    ('height', '<i4'),
+    ('width', '<i4'),
+    ('channels', '<i4'),
+    ('_pad', '<i4'),
+])
+# 共有メモリ先頭の制御領域: [最新フレーム番号, スロット数, 1スロットの最大バイト数, 書き込み終了フラグ]
+_CONTROL_FIELDS = 4
+_ALIGN = 64
+
+def _aligned(size):
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+class SharedFrameRing:
+    """プロセス間でフレームを受け渡す共有メモリ上のリングバッファ
+
+    書き込み側は writable_view() で得たスロットに直接フレームを書き (cv2.VideoCapture.read の
+    書き込み先にもできる)、publish() で公開する。読み出し側は別プロセスからでも名前で attach し、
+    pickle もコピーもせずにスロットを NumPy のビューとして参照する。
+    ビューの内容は slots - 1 フレーム後に上書きされるので、長く使う場合は is_current() で
+    確認するか、コピーを取ること。タイムスタンプは time.perf_counter (プロセス間で共通の単調時計)。
+    """
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        buf = shm.buf
+        self._control = np.ndarray((_CONTROL_FIELDS,), dtype='<i8', buffer=buf)
+        self.slots = int(self._control[1])
+        self.slot_bytes = int(self._control[2])
+        header_offset = _aligned(self._control.nbytes)
+        self._headers = np.ndarray((self.slots,), dtype=SLOT_HEADER_DTYPE, buffer=buf, offset=header_offset)
+        data_offset = _aligned(header_offset + self._headers.nbytes)
+        self._data = [
+            np.ndarray((self.slot_bytes,), dtype=np.uint8, buffer=buf, offset=data_offset + i * self.slot_bytes)
+            for i in range(self.slots)
+        ]
+
+    @classmethod
+    def create(cls, max_shape, slots=4, name=None):
+        """max_shape (高さ, 幅, チャンネル) までのフレームを slots 枚保持するリングを作る"""
+        slot_bytes = _aligned(int(np.prod(max_shape)))
+        size = (_aligned(_CONTROL_FIELDS * 8) + _aligned(slots * SLOT_HEADER_DTYPE.itemsize)
+                + slots * slot_bytes)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        control = np.ndarray((_CONTROL_FIELDS,), dtype='<i8', buffer=shm.buf)
+        control[:] = (0, slots, slot_bytes, 0)
+        del control
+        ring = cls(shm, owner=True)
+        ring._headers['frame_id'] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """別プロセスで作られたリングに接続する"""
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def latest_id(self):
+        """公開済みの最新フレーム番号 (0 は未公開)"""
+        return int(self._control[0])
+
+    @property
+    def closed_by_writer(self):
+        """書き込み側がストリームの終了を通知したか"""
+        return bool(self._control[3])
+
+    # --- 書き込み側 ---
+    def writable_view(self, shape):
+        """次のフレームを書き込むスロットのビュー (shape) を返す"""
+        if int(np.prod(shape)) > self.slot_bytes:
+            raise ValueError(f"フレーム {shape} がスロットの大きさ ({self.slot_bytes} バイト) を超えています。")
+        frame_id = self.latest_id + 1
+        slot = frame_id % self.slots
+        # 書き込み中であることを示し、読み出し側が古いヘッダで参照しないようにする
+        self._headers[slot]['frame_id'] = -1
+        return self._data[slot][:int(np.prod(shape))].reshape(shape)
+
+    def publish(self, shape, timestamp=None):
+        """writable_view() に書き込んだフレームを公開し、そのフレーム番号を返す"""
+        frame_id = self.latest_id + 1
+        header = self._headers[frame_id % self.slots]
+        height, width = shape[:2]
+        header['timestamp'] = time.perf_counter() if timestamp is None else timestamp
+        header['height'] = height
+        header['width'] = width
+        header['channels'] = shape[2] if len(shape) > 2 else 1
+        header['frame_id'] = frame_id
+        self._control[0] = frame_id
+        return frame_id
+
+    def write(self, frame, timestamp=None):
+        """フレームをコピーして公開する"""
+        np.copyto(self.writable_view(frame.shape), frame)
+        return self.publish(frame.shape, timestamp)
+
+    def close_stream(self):
+        """これ以上フレームを書かないことを読み出し側に知らせる"""
+        self._control[3] = 1
+
+    # --- 読み出し側 ---
+    def _view(self, frame_id):
+        slot = frame_id % self.slots
+        header = self._headers[slot]
+        if int(header['frame_id']) != frame_id:
+            return None, None
+        channels = int(header['channels'])
+        shape = (int(header['height']), int(header['width'])) + ((channels,) if channels > 1 else ())
+        frame = self._data[slot][:int(np.prod(shape))].reshape(shape)
+        return float(header['timestamp']), frame
+
+    def read_latest(self):
+        """最新フレームを (フレーム番号, 取得時刻, ビュー) で返す (未公開なら (None, None, None))"""
+        frame_id = self.latest_id
+        if frame_id == 0:
+            return None, None, None
+        timestamp, frame = self._view(frame_id)
+        if frame is None:
+            return None, None, None
+        return frame_id, timestamp, frame
+
+    def read_new(self, last_id, timeout=None, poll_interval=0.001):
+        """last_id より新しいフレームが公開されるまで待ち、(フレーム番号, 取得時刻, ビュー) を返す
+
+        timeout 秒以内に届かない場合や書き込み側が終了した場合は (None, None, None) を返す。
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self.latest_id <= last_id:
+            if self.closed_by_writer or (deadline is not None and time.perf_counter() >= deadline):
+                return None, None, None
+            time.sleep(poll_interval)
+        return self.read_latest()
+
+    def is_current(self, frame_id):
+        """frame_id のスロットがまだ上書きされていないか"""
+        return int(self._headers[frame_id % self.slots]['frame_id']) == frame_id
+
+    def close(self):
+        """ビューを手放して共有メモリを閉じる (作成側は削除もする)"""
+        self._control = None
+        self._headers = None
+        self._data = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -10,7 +10,8 @@ class ThreadedCamera:
         self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
         self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
         
-        self.q = queue.Queue()
+        # 最新フレームだけを保持する (読み出しが遅れてもフレームが溜まり続けないように)
+        self.q = queue.Queue(maxsize=1)
         self.running = True
         
     def start(self):
@@ -20,8 +21,10 @@ class ThreadedCamera:
     def update(self):
         while self.running:
             ret, frame = self.capture.read()
-            if not self.q.empty():
-                self.q.get()
+            try:
+                self.q.get_nowait()
+            except queue.Empty:
+                pass
             self.q.put(frame)
             
     def read(self):
@@ -0,0 +1,113 @@
+import time
+import logging
+
+import cv2
+
+from BufferRing import BufferRing
+from FrameSource import FrameSource
+
+class WebcamVideoStream(FrameSource):
+    """キャプチャスレッドで最新フレームを取得し続ける
+
+    キャプチャスレッドは grab() でドライバのキューを常に空にし続け (古いフレームが溜まらない)、
+    retrieve() (MJPG のデコード) は読み出し側が新しいフレームを求めている時に、その次に grab() した
+    フレームだけに行う。推論がカメラより遅くても、読まれずに捨てられるフレームや、読まれるまで
+    古くなっていくフレームはデコードしない。
+    フレームは ring_size 個の使い回しバッファに直接デコードする (毎フレームの確保をしない)。
+    read 系で返したフレームは、その後 ring_size - 1 フレームデコードされると上書きされるので、
+    それより長く保持する場合は呼び出し側でコピーすること。
+
+    passthrough=True では MJPG を BGR に変換せず、JPEG のバイト列のまま配信する (展開は MjpegDecoder)。
+    バックエンドが対応していない場合は展開済みのフレームが届くので、読み出し側は両方を扱うこと。
+
+    CAP_PROP_BUFFERSIZE は設定しない。grab() で取り出し続ける限りドライバのバッファ数は遅延に
+    影響せず、1 にするとアプリがバッファを保持している間にドライバがフレームを落とすため FPS が下がる。
+    """
+    def __init__(self, src=0, width=1280, height=720, fps=30, ring_size=4,
+                 passthrough=False, fourcc='MJPG', capture_factory=cv2.VideoCapture):
+        self.stream = capture_factory(src)
+        if not self.stream.isOpened():
+            # IOErrorは呼び出し元で処理されるので、ここではloggingしない
+            raise IOError("Webカメラを開けませんでした。")
+
+        self.stream.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.stream.set(cv2.CAP_PROP_FPS, fps)
+        passthrough = passthrough and fourcc == 'MJPG' and self.stream.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        
+        # 露出・フォーカス設定
+        self.stream.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1) 
+        self.stream.set(cv2.CAP_PROP_AUTOFOCUS, 0)
+        self.stream.set(cv2.CAP_PROP_FOCUS, 400)
+
+        super().__init__(width, height, fps)
+        # JPEG のまま受け取る場合、バイト列の長さはフレームごとに変わるので使い回しバッファは使わない
+        self.passthrough = passthrough
+        self._ring = BufferRing(ring_size)
+        self.grabbed_frames = 0   # grab() したフレーム数
+        self.decoded_frames = 0   # retrieve() でデコードしたフレーム数
+        # set_mode() で要求され、キャプチャスレッドが次の grab() の前に反映するモード
+        self._pending_mode = None
+        self._min_frame_interval = 0.0
+        self._last_publish_time = 0.0
+
+    def _request_mode(self, name):
+        """実際の設定変更はキャプチャスレッドが次の読み込みの前に行う"""
+        if name != self.mode or self._pending_mode is not None:
+            self._pending_mode = name
+
+    def _apply_pending_mode(self):
+        """ストリームを開いたまま解像度・FPSを設定し直す (キャプチャスレッドから呼ぶ)"""
+        name, self._pending_mode = self._pending_mode, None
+        if name == self.mode:
+            return
+        width, height, fps = self.capture_modes[name]
+        self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.stream.set(cv2.CAP_PROP_FPS, fps)
+        self._min_frame_interval = self._min_publish_interval(fps)
+        self._switch_mode(name)
+
+    def update(self):
+        while not self.stopped:
+            if self._pending_mode is not None:
+                self._apply_pending_mode()
+            grabbed = self.stream.grab()
+            if not grabbed:
+                logging.error("ストリームの終端またはエラー。スレッドを停止します。")
+                self._end_of_stream()
+                break
+            frame_time = time.perf_counter()
+            self.grabbed_frames += 1
+            if frame_time - self._last_publish_time < self._min_frame_interval:
+                continue
+            # 読み出し側が待っている時だけデコードする (最初のフレームは start() が待っている)
+            if self.grabbed and not self._frame_requested:
+                continue
+            buffer = None if self.passthrough else self._ring.peek()
+            (decoded, frame) = self.stream.retrieve(buffer) if buffer is not None else self.stream.retrieve()
+            if not decoded:
+                logging.debug("フレームのデコードに失敗しました。スキップします。")
+                continue
+            self.decoded_frames += 1
+            self._last_publish_time = frame_time
+            if not self.passthrough:
+                self._ring.advance(frame)
+            self._publish(frame, frame_time, frame_id=self.grabbed_frames)
+
+    def get_stats(self):
+        """取得・デコードしたフレーム数、重複読み出し数、取りこぼしフレーム数を返す"""
+        with self._frame_cond:
+            return self._read_stats(self.grabbed_frames, self.grabbed_frames, self.decoded_frames)
+
+    def _release(self):
+        self.stream.release()
+        logging.info("Webカメラリソースを解放しました。")
+
+    def get_actual_props(self):
+        width = int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = self.stream.get(cv2.CAP_PROP_FPS)
+        focus = self.stream.get(cv2.CAP_PROP_FOCUS)
+        return width, height, fps, focus
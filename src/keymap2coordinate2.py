@@ -1,4 +1,14 @@
-from bs4 import BeautifulSoup as bs
+import hashlib
+import os
+
+import xml.etree.ElementTree as ET
+import zipfile
+
+import numpy as np
+
+# 解析済みキーマップのキャッシュ (XMLと同じ場所に "<XML名>.npz" として保存)
+CACHE_SUFFIX = ".npz"
+CACHE_VERSION = 1
 
 class KeySwitch:
     """個々のキーを表すクラス"""
@@ -18,6 +28,7 @@ class KeyBoard:
         self.width = float(width)
         self.height = float(height)
         self.keys = []
+        self.normalized = False
     
     def append_key(self, key: KeySwitch):
         """キーを追加"""
@@ -32,60 +43,135 @@ class KeyBoard:
     #         key.height /= self.width
     def normalize(self):
         """座標を正規化（幅と高さそれぞれを1.0とする）"""
+        if self.normalized:
+            return
+        self.normalized = True
         for key in self.keys:
             key.x /= self.width
             key.y /= self.height
             key.width /= self.width
             key.height /= self.height
     
+    def to_arrays(self):
+        """キー一覧を (keycode, x, y, width, height) の NumPy 配列にまとめる"""
+        keycodes = np.array([key.keycode for key in self.keys], dtype=str)
+        x = np.array([key.x for key in self.keys], dtype=np.float64)
+        y = np.array([key.y for key in self.keys], dtype=np.float64)
+        w = np.array([key.width for key in self.keys], dtype=np.float64)
+        h = np.array([key.height for key in self.keys], dtype=np.float64)
+        return keycodes, x, y, w, h
+
+    @classmethod
+    def from_arrays(cls, width, height, keycodes, x, y, w, h):
+        """NumPy 配列からキーボードを組み立てる"""
+        keyboard = cls(width, height)
+        keyboard.keys = [
+            KeySwitch(str(keycode), kx, ky, kw, kh)
+            for keycode, kx, ky, kw, kh in zip(keycodes, x.tolist(), y.tolist(), w.tolist(), h.tolist())
+        ]
+        return keyboard
+
     def __repr__(self):
         return f"KeyBoard(width={self.width}, height={self.height}, keys={len(self.keys)})"
 
-def loadKeyBoard(filename):
-    """XMLファイルからキーボードデータを読み込む"""
+def _hash_file(filename):
+    """ファイル内容の SHA-256 を返す"""
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def loadKeyBoardCache(filename, cache_path=None, normalize=False):
+    """キャッシュが XML と一致していれば (キーボード, ハッシュ) を返す。無効なら (None, ハッシュ)"""
+    cache_path = cache_path or filename + CACHE_SUFFIX
     try:
-        with open(filename, "r", encoding="utf-8") as keymap:
-            soup = bs(keymap, "xml")
-            keyboard = None
-            
-            # FRAMEを検索してキーボードのサイズを取得
-            for cell in soup.find_all("mxCell", vertex="1"):
-                value = cell.get("value")
-                geometry = cell.find("mxGeometry")
-                
-                if value == "FRAME" and geometry:
-                    frame_w = float(geometry.get("width", 0))
-                    frame_h = float(geometry.get("height", 0))
-                    keyboard = KeyBoard(frame_w, frame_h)
-                    print(f"キーボードサイズ: {frame_w} x {frame_h}")
-                    break
-            
-            if keyboard is None:
-                raise ValueError("FRAMEが見つかりませんでした")
-            
-            # キースイッチを抽出してキーボードに追加
-            key_count = 0
-            for cell in soup.find_all("mxCell", vertex="1"):
-                value = cell.get("value")
-                geometry = cell.find("mxGeometry")
-                
-                # FRAMEは除外
-                if value == "FRAME" or not value or not geometry:
-                    continue
-                
-                keycode = value.strip()
-                if keycode:  # 空文字列は除外
-                    x = float(geometry.get("x", 0))
-                    y = float(geometry.get("y", 0))
-                    w = float(geometry.get("width", 0))
-                    h = float(geometry.get("height", 0))
-                    
-                    key = KeySwitch(keycode, x, y, w, h)
-                    keyboard.append_key(key)
-                    key_count += 1
-            
-            print(f"読み込まれたキー数: {key_count}")
-            return keyboard
+        stat = os.stat(filename)
+        refresh = None
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if int(cache["version"]) != CACHE_VERSION:
+                return None, None
+            # mtime とサイズが同じならハッシュ計算も省略する
+            if int(cache["source_mtime_ns"]) == stat.st_mtime_ns and int(cache["source_size"]) == stat.st_size:
+                source_hash = str(cache["source_hash"])
+            else:
+                source_hash = _hash_file(filename)
+                if source_hash != str(cache["source_hash"]):
+                    return None, source_hash
+                # 内容は同じ (git checkout などで mtime だけ変わった) なので、次回から高速経路に乗るよう記録し直す
+                refresh = {name: cache[name] for name in cache.files}
+            frame_w, frame_h = cache["frame"].tolist()
+            x, y, w, h = cache["x"], cache["y"], cache["width"], cache["height"]
+            if normalize:
+                # KeySwitch を作る前に配列のまま正規化する
+                x, y, w, h = x / frame_w, y / frame_h, w / frame_w, h / frame_h
+            keyboard = KeyBoard.from_arrays(frame_w, frame_h, cache["keycode"], x, y, w, h)
+            keyboard.normalized = normalize
+        if refresh is not None:
+            # (読み込み中のファイルは置き換えられない環境もあるので、閉じてから書く)
+            _refresh_cache_stat(cache_path, refresh, stat)
+        return keyboard, source_hash
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        # 壊れたキャッシュ (空・途中で切れた .npz など) は無視して XML を解析し直す
+        return None, None
+
+def _refresh_cache_stat(cache_path, arrays, stat):
+    """キャッシュに記録した XML の mtime とサイズだけを書き換える (書けなくても読み込みは続ける)"""
+    arrays.update(source_mtime_ns=stat.st_mtime_ns, source_size=stat.st_size)
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+def saveKeyBoardCache(keyboard, filename, source_hash=None, cache_path=None):
+    """解析済み (正規化前) のキーボードをキャッシュに保存する"""
+    cache_path = cache_path or filename + CACHE_SUFFIX
+    stat = os.stat(filename)
+    keycodes, x, y, w, h = keyboard.to_arrays()
+    # 書き込み途中のファイルを読まないよう一時ファイル経由で置き換える
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f,
+                 version=CACHE_VERSION,
+                 source_hash=source_hash or _hash_file(filename),
+                 source_mtime_ns=stat.st_mtime_ns,
+                 source_size=stat.st_size,
+                 frame=np.array([keyboard.width, keyboard.height], dtype=np.float64),
+                 keycode=keycodes, x=x, y=y, width=w, height=h)
+    os.replace(tmp_path, cache_path)
+
+def loadKeyBoard(filename, use_cache=True, normalize=False, parser="stream"):
+    """XMLファイル (またはそのキャッシュ) からキーボードデータを読み込む"""
+    source_hash = None
+    keyboard = None
+    if use_cache:
+        keyboard, source_hash = loadKeyBoardCache(filename, normalize=normalize)
+        if keyboard is not None:
+            print(f"キャッシュからキーボードデータを読み込みました: {keyboard}")
+
+    if keyboard is None:
+        keyboard = parseKeyBoardXML(filename, parser)
+        if use_cache:
+            try:
+                saveKeyBoardCache(keyboard, filename, source_hash)
+            except OSError as e:
+                print(f"キーボードキャッシュを保存できませんでした: {e}")
+
+    if normalize:
+        keyboard.normalize()
+    return keyboard
+
+def parseKeyBoardXML(filename, parser="stream"):
+    """XMLファイルからキーボードデータを読み込む (parser: "stream" または "bs4")"""
+    try:
+        if parser == "stream":
+            keyboard = _parseKeyBoardStream(filename)
+        elif parser == "bs4":
+            keyboard = _parseKeyBoardSoup(filename)
+        else:
+            raise ValueError(f"不明なパーサです: {parser}")
+        print(f"読み込まれたキー数: {len(keyboard.keys)}")
+        return keyboard
             
     except FileNotFoundError:
         print(f"ファイル '{filename}' が見つかりませんでした")
@@ -94,6 +180,92 @@ def loadKeyBoard(filename):
         print(f"キーボードデータの読み込み中にエラーが発生しました: {e}")
         raise
 
+def _parseKeyBoardStream(filename):
+    """iterparse で1パスだけ走査し、FRAMEとキーを同時に集めて配列から組み立てる"""
+    frame_size = None
+    keycodes, xs, ys, ws, hs = [], [], [], [], []
+
+    # 親要素をたどれるよう開始タグをスタックに積み、処理済みの mxCell は親から外して解放する
+    stack = []
+    for event, elem in ET.iterparse(filename, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag != "mxCell":
+            continue
+
+        if elem.get("vertex") == "1":
+            value = elem.get("value")
+            geometry = next(elem.iter("mxGeometry"), None)
+            if value == "FRAME":
+                if frame_size is None and geometry is not None:
+                    frame_size = (float(geometry.get("width", 0)), float(geometry.get("height", 0)))
+            elif value and geometry is not None:
+                keycode = value.strip()
+                if keycode:  # 空文字列は除外
+                    keycodes.append(keycode)
+                    xs.append(float(geometry.get("x", 0)))
+                    ys.append(float(geometry.get("y", 0)))
+                    ws.append(float(geometry.get("width", 0)))
+                    hs.append(float(geometry.get("height", 0)))
+
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+    if frame_size is None:
+        raise ValueError("FRAMEが見つかりませんでした")
+    frame_w, frame_h = frame_size
+    print(f"キーボードサイズ: {frame_w} x {frame_h}")
+
+    return KeyBoard.from_arrays(frame_w, frame_h, keycodes,
+                                np.array(xs), np.array(ys), np.array(ws), np.array(hs))
+
+def _parseKeyBoardSoup(filename):
+    """BeautifulSoup でXML全体を木構造にしてからキーボードデータを読み込む"""
+    from bs4 import BeautifulSoup as bs  # 読み込みが重いので必要な時だけ import
+
+    with open(filename, "r", encoding="utf-8") as keymap:
+        soup = bs(keymap, "xml")
+        keyboard = None
+        
+        # FRAMEを検索してキーボードのサイズを取得
+        for cell in soup.find_all("mxCell", vertex="1"):
+            value = cell.get("value")
+            geometry = cell.find("mxGeometry")
+            
+            if value == "FRAME" and geometry:
+                frame_w = float(geometry.get("width", 0))
+                frame_h = float(geometry.get("height", 0))
+                keyboard = KeyBoard(frame_w, frame_h)
+                print(f"キーボードサイズ: {frame_w} x {frame_h}")
+                break
+        
+        if keyboard is None:
+            raise ValueError("FRAMEが見つかりませんでした")
+        
+        # キースイッチを抽出してキーボードに追加
+        for cell in soup.find_all("mxCell", vertex="1"):
+            value = cell.get("value")
+            geometry = cell.find("mxGeometry")
+            
+            # FRAMEは除外
+            if value == "FRAME" or not value or not geometry:
+                continue
+            
+            keycode = value.strip()
+            if keycode:  # 空文字列は除外
+                x = float(geometry.get("x", 0))
+                y = float(geometry.get("y", 0))
+                w = float(geometry.get("width", 0))
+                h = float(geometry.get("height", 0))
+                
+                key = KeySwitch(keycode, x, y, w, h)
+                keyboard.append_key(key)
+        
+        return keyboard
+
 if __name__ == "__main__":
     try:
         keyboard = loadKeyBoard("keymap.xml")
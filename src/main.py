@@ -1,128 +1,219 @@
+import time
+_LAUNCH_TIME = time.perf_counter()  # 起動時間計測の基準 (import より前に記録)
+
 from keymap2coordinate2 import loadKeyBoard # ユーザーの環境に存在することを前提とします
 import cv2
-import mediapipe as mp
 import numpy as np
 from KeyboardMapper import KeyboardMapper # KeyboardMapper.py からインポート
+from HandTracker import HandTracker, roi_from_corners
+from WebcamVideoStream import WebcamVideoStream
+from CaptureProcess import CaptureProcess
+from FramePipeline import FramePacket, FramePipeline, LatestValueQueue
+from InferenceProcessPool import InferenceProcessPool
+from QualityController import QualityController
+from MotionGate import MotionGate
+from IdleMonitor import IdleMonitor
+from KeyEventEngine import KeyEventEngine
+from LandmarkPredictor import LandmarkPredictor
+from BufferRing import BufferRing
+from MjpegDecoder import MjpegDecoder
+from CameraProbe import CameraProber
+from FrameSource import create_frame_source, parse_source_spec
+from OutputSink import AsyncLogWriter, create_sink, parse_sink_spec
+from concurrent.futures import ThreadPoolExecutor
 import threading
-import time
+import argparse
 import logging
 
-class HandTracker:
+class StartupProfiler:
+    """起動処理の各フェーズ (並列実行を含む) の開始・終了時刻を記録する"""
+    def __init__(self, origin=None):
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.phases = []  # (名前, 開始, 終了) 起動からの経過秒
+        self._lock = threading.Lock()
+
+    def run(self, name, func, *args, **kwargs):
+        """func を実行し、その所要時間を name のフェーズとして記録する"""
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._record(name, start, time.perf_counter())
+
+    def mark(self, name):
+        """現在時刻を name の時点として記録する"""
+        now = time.perf_counter()
+        self._record(name, now, now)
+
+    def _record(self, name, start, end):
+        with self._lock:
+            self.phases.append((name, start - self.origin, end - self.origin))
+
+    def report(self):
+        """フェーズごとの内訳をログに出力する"""
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        lines = [
+            f"  {name:<22} {start * 1000:8.1f} ms -> {end * 1000:8.1f} ms ({(end - start) * 1000:7.1f} ms)"
+            for name, start, end in phases
+        ]
+        logging.info("起動時間の内訳 (起動からの経過時間):\n" + "\n".join(lines))
+
+class RunMetrics:
+    """メインループで処理したフレーム数・処理時間・遅延・キーイベント数を集計する"""
     def __init__(self):
-        self.mp_hands = mp.solutions.hands
-        self.mp_drawing = mp.solutions.drawing_utils
-        self.hands = self.mp_hands.Hands(
-            max_num_hands=2,
-            min_detection_confidence=0.7,
-            min_tracking_confidence=0.5
-        )
-    
-    def process_frame(self, frame):
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        rgb_frame.flags.writeable = False
-        results = self.hands.process(rgb_frame)
-        rgb_frame.flags.writeable = True # 後でフレームを再利用する場合
-        return results
-    
-    def get_finger_positions(self, results, width, height):
-        finger_positions = []
-        if results.multi_handedness and results.multi_hand_landmarks:
-            for i in range(len(results.multi_hand_landmarks)):
-                hand_landmarks = results.multi_hand_landmarks[i]
-                handedness = results.multi_handedness[i]
-                label = handedness.classification[0].label
-                if label == "Left":
-                    label = "Right"
-                else:
-                    label = "Left"
-                
-                finger_tips = [4, 8, 12, 16, 20]
-                hand_fingers = []
-                for tip_id in finger_tips:
-                    landmark = hand_landmarks.landmark[tip_id]
-                    x = int(landmark.x * width)
-                    y = int(landmark.y * height)
-                    hand_fingers.append((tip_id, x, y))
-                
-                finger_positions.append({
-                    'label': label,
-                    'landmarks': hand_landmarks, # 描画用に正規化座標を保持
-                    'fingers': hand_fingers
-                })
-        return finger_positions
-    
-    def draw_landmarks(self, frame, results):
-        if results.multi_hand_landmarks:
-            for hand_landmarks in results.multi_hand_landmarks:
-                self.mp_drawing.draw_landmarks(
-                    frame, hand_landmarks, self.mp_hands.HAND_CONNECTIONS
-                )
-
-class WebcamVideoStream:
-    def __init__(self, src=0, width=1280, height=720, fps=30):
-        self.stream = cv2.VideoCapture(src)
-        if not self.stream.isOpened():
-            # IOErrorは呼び出し元で処理されるので、ここではloggingしない
-            raise IOError("Webカメラを開けませんでした。")
-
-        self.stream.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
-        self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        self.stream.set(cv2.CAP_PROP_FPS, fps)
-        
-        # 露出・フォーカス設定
-        self.stream.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1) 
-        self.stream.set(cv2.CAP_PROP_AUTOFOCUS, 0)
-        self.stream.set(cv2.CAP_PROP_FOCUS, 400)
-
-        (self.grabbed, self.frame) = self.stream.read()
-        self.stopped = False
-        self.thread = threading.Thread(target=self.update, args=())
-        self.thread.daemon = True
-
-    def start(self):
-        self.stopped = False
-        self.thread.start()
-        time.sleep(1.0) 
-        return self
-
-    def update(self):
-        while not self.stopped:
-            (grabbed, frame) = self.stream.read()
-            if not grabbed:
-                logging.error("ストリームの終端またはエラー。スレッドを停止します。")
-                self.stop()
-                break
-            self.frame = frame
-
-    def read(self):
-        return self.frame
-
-    def stop(self):
-        self.stopped = True
-        if self.thread.is_alive():
-            self.thread.join(timeout=1.0)
-        self.stream.release()
-        logging.info("Webカメラリソースを解放しました。")
-
-    def get_actual_props(self):
-        width = int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = self.stream.get(cv2.CAP_PROP_FPS)
-        focus = self.stream.get(cv2.CAP_PROP_FOCUS)
-        return width, height, fps, focus
-
-def main():
+        self.start = time.perf_counter()
+        self.frames = 0
+        self.busy = 0.0      # メインスレッドでフレームの処理に使った時間 [s] (フレーム待ちを除く)
+        self.latency = 0.0   # フレーム取得から処理完了までの遅延の合計 [s]
+        self.key_events = 0
+        self._window = (self.start, 0, 0.0, 0.0)
+
+    def record(self, busy, latency, key_events):
+        self.frames += 1
+        self.busy += busy
+        self.latency += latency
+        self.key_events += key_events
+
+    def window(self):
+        """前回の呼び出しからの区間の集計を返す"""
+        now = time.perf_counter()
+        start, frames, busy, latency = self._window
+        self._window = (now, self.frames, self.busy, self.latency)
+        return self._summarize(now - start, self.frames - frames, self.busy - busy, self.latency - latency)
+
+    def summary(self):
+        """開始からの集計を返す"""
+        return dict(self._summarize(time.perf_counter() - self.start, self.frames, self.busy, self.latency),
+                    key_events=self.key_events)
+
+    @staticmethod
+    def _summarize(elapsed, frames, busy, latency):
+        return {
+            'frames': frames,
+            'elapsed': elapsed,
+            'fps': frames / elapsed if elapsed > 0 else 0.0,
+            'busy_ms': busy / frames * 1000 if frames else 0.0,
+            'latency_ms': latency / frames * 1000 if frames else 0.0,
+        }
+
+def scale_corners(corners, from_size, to_size):
+    """from_size (幅, 高さ) の画像で測ったキーボード4角を to_size の画像の座標に変換する"""
+    scale_x = to_size[0] / from_size[0]
+    scale_y = to_size[1] / from_size[1]
+    return [[x * scale_x, y * scale_y] for x, y in corners]
+
+def _open_camera(profiler, width, height, fps, capture_process=False, passthrough=False,
+                 probe=False, reprobe=False, src=0):
+    """カメラを開いて設定し、最初のフレームが届くまで待つ"""
+    fourcc = 'MJPG'
+    if probe or reprobe:
+        # 計測済みのプロファイルがあればそれを使い、無ければ FOURCC ごとに計測して選ぶ
+        profile = profiler.run("camera_probe", CameraProber().get_profile, src, width, height, fps, reprobe=reprobe)
+        if profile is not None:
+            fourcc, width, height = profile['fourcc'], profile['width'], profile['height']
+    if capture_process:
+        vs = profiler.run("camera_open", CaptureProcess, src=src, width=width, height=height, fps=fps,
+                          fourcc=fourcc)
+    else:
+        vs = profiler.run("camera_open", WebcamVideoStream, src=src, width=width, height=height, fps=fps,
+                          passthrough=passthrough, fourcc=fourcc)
+    return profiler.run("camera_first_frame", vs.start)
+
+def _release_tracker(tracker_future):
+    """起動途中で終了する時に、並列に起動した推論ワーカー (プロセスと共有メモリ) を止める"""
+    try:
+        tracker = tracker_future.result()
+    except Exception:
+        return  # 起動に失敗していれば解放するものはない
+    if isinstance(tracker, InferenceProcessPool):
+        tracker.stop()
+
+def _sink_spec(spec):
+    """--output の書式を起動前に確かめる (argparse の type)"""
+    try:
+        parse_sink_spec(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return spec
+
+def _open_source(profiler, args, width, height, fps):
+    """--source で指定されたフレームの供給元 (カメラ・動画・画像フォルダ・合成フレーム) を開く"""
+    kind, arg = parse_source_spec(args.source)
+    if kind == "camera":
+        return _open_camera(profiler, width, height, fps, args.capture_process, args.mjpeg_passthrough,
+                            args.probe_camera, args.reprobe_camera, src=int(arg) if arg else 0)
+    vs = profiler.run("source_open", create_frame_source, args.source, width, height, fps,
+                      realtime=args.pace == "realtime", loop=args.loop)
+    return profiler.run("source_first_frame", vs.start)
+
+def main(args=None):
+    if args is None:
+        args = parse_args()
+    profiler = StartupProfiler(origin=_LAUNCH_TIME)
+    profiler.mark("main_start")
+
     KEYBOARD_CORNERS = [
         [10, 20], [642, 20], [598, 215], [51, 215]
     ]
+    CORNERS_FRAME_SIZE = (640, 360)  # KEYBOARD_CORNERS を計測した時の解像度
     
+    FRAME_WIDTH, FRAME_HEIGHT = args.capture_size
+    REQUESTED_FPS = 30
+
+    # ROI モードではキーボード周辺だけを推論する
+    corners = scale_corners(KEYBOARD_CORNERS, CORNERS_FRAME_SIZE, (FRAME_WIDTH, FRAME_HEIGHT))
+    roi = roi_from_corners(corners, args.roi_margin) if args.roi else None
+    if roi is not None:
+        logging.info(f"推論領域 (ROI): {roi}")
+    if args.inference_scale != 1.0:
+        logging.info(f"推論解像度の倍率: {args.inference_scale}")
+    hands_kwargs = {'roi': roi, 'inference_scale': args.inference_scale, 'frame_skip': args.frame_skip}
+    if args.frame_skip > 0:
+        logging.info(f"推論は {args.frame_skip + 1} フレームに1回行います。")
+    if args.motion_gate:
+        # キーボード周辺 (ROI と同じ範囲) に動きがない間は推論を省く
+        hands_kwargs['motion_gate'] = MotionGate(roi_from_corners(corners, args.roi_margin),
+                                                 motion_threshold=args.motion_threshold)
+
+    # パイプライン・推論ワーカーの出力キューが満杯の時の挙動
+    drop_policy = args.drop_policy
+    if drop_policy is None:
+        # 供給元の速さを処理に合わせる (--pace max) 場合は、キューでもフレームを落とさない
+        realtime = args.pace == "realtime" or args.source.startswith("camera")
+        drop_policy = "drop_oldest" if realtime else "block"
+
+    # キーマップ読み込み・MediaPipe モデル読み込み・カメラ初期化を並列に実行
+    executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup")
+    keyboard_future = executor.submit(profiler.run, "keymap", loadKeyBoard, "configs/keymap2.xml", normalize=True)
+    if args.inference_workers > 0:
+        # 推論はワーカープロセス側でモデルを読み込む
+        tracker_future = executor.submit(
+            profiler.run, "inference_workers",
+            lambda: InferenceProcessPool(None, (FRAME_HEIGHT, FRAME_WIDTH, 3),
+                                         num_workers=args.inference_workers,
+                                         hands_kwargs=hands_kwargs, drop_policy=drop_policy).start_workers())
+    else:
+        tracker_future = executor.submit(profiler.run, "hand_tracker", HandTracker, **hands_kwargs)
+    if args.mjpeg_passthrough and args.capture_process:
+        logging.warning("キャプチャプロセスでは MJPG のパススルーを使えません。カメラ側で展開します。")
+    camera_future = executor.submit(_open_source, profiler, args, FRAME_WIDTH, FRAME_HEIGHT, REQUESTED_FPS)
+    executor.shutdown(wait=False)
+
     try:
-        keyboard = loadKeyBoard("configs/keymap2.xml")
-        keyboard.normalize()
+        vs = camera_future.result()
+    except (IOError, ValueError) as e:
+        logging.critical(f"フレームの供給元の初期化に失敗しました: {e}")
+        _release_tracker(tracker_future)
+        return
+
+    try:
+        keyboard = keyboard_future.result()
         logging.info("キーボードデータを正常に読み込みました。")
     except Exception:
         logging.exception("キーボードデータの読み込みに失敗しました。") # 例外情報をログに出力
+        vs.stop()
+        _release_tracker(tracker_future)
         exit()
         # logging.warning("ダミーキーボードデータを使用します。")
         # # ダミーのキーボードデータ
@@ -134,19 +225,6 @@ def main():
         #     def normalize(self): pass
         # keyboard = DummyKeyboard()
 
-    hand_tracker = HandTracker()
-    keyboard_mapper = KeyboardMapper(keyboard, KEYBOARD_CORNERS)
-    
-    FRAME_WIDTH = 640
-    FRAME_HEIGHT = 360
-    REQUESTED_FPS = 30
-    
-    try:
-        vs = WebcamVideoStream(src=0, width=FRAME_WIDTH, height=FRAME_HEIGHT, fps=REQUESTED_FPS).start()
-    except IOError as e:
-        logging.critical(f"カメラの初期化に失敗しました: {e}")
-        return
-
     actual_width, actual_height, actual_fps, initial_focus = vs.get_actual_props()
     logging.info(f"要求カメラ設定: {FRAME_WIDTH}x{FRAME_HEIGHT} @ {REQUESTED_FPS} FPS")
     logging.info(f"実カメラ設定: {actual_width}x{actual_height} @ {actual_fps} FPS")
@@ -155,52 +233,376 @@ def main():
     if actual_width == 0 or actual_height == 0:
         logging.critical("カメラから有効な解像度を取得できませんでした。終了します。")
         vs.stop()
+        _release_tracker(tracker_future)
         return
 
+    if (actual_width, actual_height) != (FRAME_WIDTH, FRAME_HEIGHT):
+        # 実解像度に合わせてキーボード4角と ROI を計算し直す
+        corners = scale_corners(KEYBOARD_CORNERS, CORNERS_FRAME_SIZE, (actual_width, actual_height))
+        if roi is not None:
+            roi = roi_from_corners(corners, args.roi_margin)
+            hands_kwargs['roi'] = roi
+            logging.info(f"推論領域 (ROI) を実解像度に合わせて変更しました: {roi}")
+        if args.motion_gate:
+            hands_kwargs['motion_gate'].region = roi_from_corners(corners, args.roi_margin)
+
+    # 実解像度でキー判定用ラスタを作成 (以降の判定は画素参照のみ)
+    # 指とキーの対応・キーイベントはバックグラウンドスレッドで出力先に書き出す
     try:
-        while not vs.stopped:
-            frame = vs.read()
+        sink = create_sink(args.output)
+    except (OSError, ValueError) as e:
+        logging.critical(f"出力先を開けませんでした: {e}")
+        vs.stop()
+        _release_tracker(tracker_future)
+        return
+    output = AsyncLogWriter(sink, rate_limit=args.output_rate, changes_only=args.changes_only).start() if sink else None
+    keyboard_mapper = KeyboardMapper(keyboard, corners, finger_log=output)
+    profiler.run("key_raster", keyboard_mapper.set_frame_size, actual_width, actual_height)
+    # 指ごとのキー判定結果から押下・解放イベントを生成する
+    key_engine = KeyEventEngine(keyboard, press_mode=args.press_mode, dwell_time=args.dwell_time,
+                                depth_threshold=args.depth_threshold)
+
+    # MediaPipe モデルの読み込み完了を待つ (ここまでの処理と並行して進んでいる)
+    hand_tracker = None
+    inference_pool = None
+    if args.inference_workers > 0:
+        inference_pool = tracker_future.result()
+        if inference_pool.frame_shape != (actual_height, actual_width, 3):
+            # 実解像度が要求と異なる場合は共有メモリを作り直す
+            inference_pool.stop()
+            inference_pool = InferenceProcessPool(None, (actual_height, actual_width, 3),
+                                                  num_workers=args.inference_workers,
+                                                  hands_kwargs=hands_kwargs, drop_policy=drop_policy)
+    else:
+        hand_tracker = tracker_future.result()
+        hand_tracker.set_roi(roi)
+    # --- フレームごとの処理 (直列モード・パイプラインモード共通) ---
+    def inference_stage(packet):
+        packet.hands = hand_tracker.process_frame(packet.frame, packet.scale)
+        packet.inferred = hand_tracker.last_inferred
+        packet.static = hand_tracker.last_static
+        return packet
+
+    # 推論結果を平滑化し、推論しなかったフレームや処理遅延の分は指先の動きから外挿する
+    predictor = LandmarkPredictor() if args.predict else None
+
+    def mapping_stage(packet):
+        if predictor is not None:
+            if packet.inferred:
+                predictor.update(packet.hands, packet.timestamp)
+            elif packet.static:
+                # 静止と判定されたフレームは速度 0 の観測とし、外挿するのは frame_skip で省いたフレームだけにする
+                predictor.update_static(packet.hands, packet.timestamp)
+            # 推論済みのフレームでも、キー判定を行う現在時刻まで外挿して遅延を補う
+            packet.hands = predictor.predict(time.perf_counter())
+        packet.key_indices = keyboard_mapper.get_key_indices_for_points(packet.hands.fingertips())
+        return packet
+
+    def render(packet):
+        frame = packet.frame
+        HandTracker.draw_landmarks(frame, packet.hands)
+        
+        # for hand in finger_positions:
+        #     for tip_id, x, y in hand['fingers']:
+        #         if tip_id == 8: # 人差し指
+        #             cv2.putText(frame, f"{x},{y}", (x-20, y-10),
+        #                         cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+        
+        # keyboard_corners_np = np.array(KEYBOARD_CORNERS, np.int32).reshape((-1, 1, 2))
+        # cv2.polylines(frame, [keyboard_corners_np], True, (255, 255, 0), 1)
+        
+        # KeyboardMapperに描画と情報出力をまとめて依頼
+        keyboard_mapper.draw_keyboard_and_finger_info(frame, packet.hands, packet.key_indices)
+
+        cv2.imshow('Hand Tracking with Virtual Keyboard', frame)
+
+    # 反転したフレームの書き込み先。処理中・キュー内のフレームの最大数より多く確保して使い回す
+    if inference_pool is not None:
+        in_flight = inference_pool.num_slots + 4
+    elif args.pipeline:
+        in_flight = 3 * args.queue_size + 4
+    else:
+        in_flight = 2
+    frame_ring = BufferRing(in_flight)
+
+    # MJPG をパススルーで受け取る場合はここで展開する。表示しない (ヘッドレス) かつ
+    # メインプロセスで推論する場合は、推論解像度に足りる大きさまで縮小して展開する
+    decoder = MjpegDecoder() if getattr(vs, 'passthrough', False) else None
+    reduced_decode = decoder is not None and args.headless and hand_tracker is not None
+    if args.mjpeg_passthrough and args.source.startswith("camera") and not args.capture_process:
+        if decoder is None:
+            logging.warning("カメラが MJPG のパススルーに対応していません。カメラ側で展開します。")
+        elif reduced_decode:
+            logging.info("MJPG をパススルーで受け取り、推論解像度に合わせて縮小展開します。")
+        else:
+            logging.info("MJPG をパススルーで受け取り、表示用に全解像度で展開します。")
+
+    def read_packet():
+        # 処理済みのフレームを再処理しないよう、新しいフレームが届くまで待つ
+        frame_id, frame_time, frame = vs.read_new(timeout=0.5)
+        if frame is None:
+            logging.debug("フレームを取得できませんでした。スキップします。")
+            return None
+        if decoder is not None and MjpegDecoder.is_encoded(frame):
+            reduction = decoder.reduction_for(hand_tracker.inference_scale) if reduced_decode else 1
+            frame = decoder.decode(frame, reduction)
             if frame is None:
-                logging.debug("フレームを取得できませんでした。スキップします。")
-                time.sleep(0.01)
+                logging.debug("JPEG を展開できませんでした。スキップします。")
+                return None
+        scale = 1.0
+        if frame.shape[:2] != (actual_height, actual_width):
+            if reduced_decode:
+                # 表示しないので拡大せず、全解像度に対する倍率だけを推論に伝える
+                scale = frame.shape[1] / actual_width
+            else:
+                # 省電力モードの低解像度フレームは表示・キー判定の解像度に揃える
+                frame = cv2.resize(frame, (actual_width, actual_height), interpolation=cv2.INTER_LINEAR)
+        # キャプチャのバッファはすぐ上書きされるので、読んだ直後に反転して手元のバッファに移す
+        frame = cv2.flip(frame, flipCode=-1, dst=frame_ring.acquire(frame.shape))
+        return FramePacket(frame_id, frame_time, frame, scale)
+
+    pipeline = None
+    if inference_pool is not None:
+        # 推論をワーカープロセスで行い、結果をフレーム番号順に受け取る
+        inference_pool.source = read_packet
+        pipeline = profiler.run("inference_workers_ready", inference_pool.start)
+        logging.info(f"推論を {args.inference_workers} 個のワーカープロセスで実行します ({drop_policy})。")
+    elif args.pipeline:
+        # 推論・キー判定を別スレッドで動かし、描画 (imshow) はメインスレッドで行う
+        pipeline = FramePipeline(
+            read_packet,
+            [("inference", inference_stage), ("mapping", mapping_stage)],
+            queue_size=args.queue_size, drop_policy=drop_policy,
+        ).start()
+        logging.info(f"パイプラインモードで実行します (キュー長 {args.queue_size}, {drop_policy})。")
+
+    quality_controller = None
+    if args.latency_budget is not None:
+        if hand_tracker is None:
+            logging.warning("ワーカープロセスでの推論中は品質の自動調整を行いません。")
+        else:
+            quality_controller = QualityController(args.latency_budget)
+            logging.info(f"遅延予算 {args.latency_budget} ms で品質を自動調整します。")
+
+    idle_monitor = None
+    idle_restore = None
+    if args.idle_after is not None:
+        idle_width, idle_height, idle_fps = args.idle_capture
+        vs.add_capture_mode('idle', idle_width, idle_height, idle_fps)
+        idle_monitor = IdleMonitor(args.idle_after)
+        logging.info(f"{args.idle_after}秒間手が見えなければ省電力モード ({idle_width}x{idle_height} @ {idle_fps} FPS) に移行します。")
+
+    if args.headless:
+        logging.info("ヘッドレスモードで実行します (描画・ウィンドウ表示なし。Ctrl+C で終了)。")
+
+    first_frame_processed = False
+    metrics = RunMetrics()
+    next_metrics_time = metrics.start + args.metrics_interval
+
+    try:
+        while True:
+            if inference_pool is not None:
+                packet = pipeline.get(timeout=0.5)
+                work_start = time.perf_counter()
+                if packet is not None:
+                    packet = mapping_stage(packet)
+            elif pipeline is not None:
+                packet = pipeline.get(timeout=0.5)
+                work_start = time.perf_counter()
+            else:
+                packet = read_packet()
+                work_start = time.perf_counter()
+                if packet is not None:
+                    packet = mapping_stage(inference_stage(packet))
+            if packet is None:
+                # 供給元が終了したら、パイプライン内に残ったフレームを処理し終えてから抜ける
+                # (推論ワーカーが全て終了して推論が止まった場合も抜ける)
+                if vs.stopped or (pipeline is not None and pipeline.stopped):
+                    break
                 continue
-            
+
+            if idle_monitor is not None:
+                mode = idle_monitor.update(len(packet.hands) > 0)
+                if mode is not None:
+                    vs.set_mode(mode)
+                    if hand_tracker is not None:
+                        if mode == 'idle':
+                            # 手の有無だけ分かればよいので軽量モデル・1手で推論する
+                            idle_restore = {name: hand_tracker.hands_params[name]
+                                            for name in ('model_complexity', 'max_num_hands')}
+                            hand_tracker.configure(model_complexity=0, max_num_hands=1)
+                        elif idle_restore is not None:
+                            hand_tracker.configure(**idle_restore)
+                            idle_restore = None
+
+            if quality_controller is not None and (idle_monitor is None or idle_monitor.mode == 'active'):
+                # フレーム取得からキー判定までの遅延に応じて推論の設定を切り替える
+                settings = quality_controller.observe(time.perf_counter() - packet.timestamp)
+                if settings is not None:
+                    hand_tracker.configure(
+                        inference_scale=args.inference_scale * settings['inference_scale'],
+                        model_complexity=settings['model_complexity'],
+                        max_num_hands=settings['max_num_hands'],
+                        frame_skip=max(args.frame_skip, settings['frame_skip']),
+                    )
+
+            key_events = key_engine.update(packet.timestamp, packet.hands, packet.key_indices)
+            if output is not None:
+                for event in key_events:
+                    output.emit(repr(event))
+
             # デバッグ用: logging.DEBUGレベルでのみ表示
             # current_focus = vs.stream.get(cv2.CAP_PROP_FOCUS) 
             # logging.debug(f"現在のフォーカス値: {current_focus}")
 
-            frame = cv2.flip(frame, flipCode=-1)
-            
-            results = hand_tracker.process_frame(frame)
-            finger_positions = hand_tracker.get_finger_positions(results, actual_width, actual_height) 
-            
-            hand_tracker.draw_landmarks(frame, results)
-            
-            # for hand in finger_positions:
-            #     for tip_id, x, y in hand['fingers']:
-            #         if tip_id == 8: # 人差し指
-            #             cv2.putText(frame, f"{x},{y}", (x-20, y-10),
-            #                         cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-            
-            # keyboard_mapper.draw_keyboard(frame, finger_positions)
-            
-            # keyboard_corners_np = np.array(KEYBOARD_CORNERS, np.int32).reshape((-1, 1, 2))
-            # cv2.polylines(frame, [keyboard_corners_np], True, (255, 255, 0), 1)
-            
-            # 4. KeyboardMapperに描画と情報出力をまとめて依頼
-            keyboard_mapper.draw_keyboard_and_finger_info(frame, finger_positions)
-
-            cv2.imshow('Hand Tracking with Virtual Keyboard', frame)
-            
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            if not args.headless:
+                render(packet)
+
+            if not first_frame_processed:
+                first_frame_processed = True
+                profiler.mark("first_processed_frame")
+                profiler.report()
+
+            quit_requested = not args.headless and cv2.waitKey(1) & 0xFF == ord('q')
+
+            now = time.perf_counter()
+            metrics.record(now - work_start, now - packet.timestamp, len(key_events))
+            if args.headless and now >= next_metrics_time:
+                next_metrics_time = now + args.metrics_interval
+                window = metrics.window()
+                line = (f"metrics fps={window['fps']:.1f} busy_ms={window['busy_ms']:.2f} "
+                        f"latency_ms={window['latency_ms']:.1f} key_events={metrics.key_events}")
+                if output is not None:
+                    output.emit(line)
+                else:
+                    logging.info(line)
+
+            if quit_requested:
                 logging.info("'q'キーが押されたため、ループを終了します。")
                 break
+            if args.max_frames is not None and metrics.frames >= args.max_frames:
+                logging.info(f"{args.max_frames} フレームを処理したため、ループを終了します。")
+                break
+    except KeyboardInterrupt:
+        logging.info("中断されたため、ループを終了します。")
     
     finally:
         logging.info("メインループ終了処理を開始します。")
+        key_events = key_engine.release_all(time.perf_counter())
+        if output is not None:
+            for event in key_events:
+                output.emit(repr(event))
+            output.close()
+            logging.info(f"出力: 書き込み {output.written} 行 / 間引き {output.suppressed} / キュー満杯で破棄 {output.dropped}")
+        if inference_pool is not None:
+            inference_pool.stop()
+            stats = inference_pool.get_stats()
+            logging.info(f"推論ワーカー: 投入 {stats['submitted']} / 完了 {stats['completed']} / 失敗 {stats['failed']} / "
+                         f"破棄 {stats['dropped']} / 平均 {stats['avg_worker_ms']:.1f} ms")
+        elif pipeline is not None:
+            pipeline.stop()
+            stats = pipeline.get_stats()
+            for name, stage in stats['stages'].items():
+                logging.info(f"ステージ '{name}': {stage['processed']} フレーム, 平均 {stage['avg_ms']:.1f} ms")
+            logging.info(f"キューでの破棄数: {stats['dropped']} / 追い越された結果: {stats['stale_outputs']}")
+        if hand_tracker is not None and hand_tracker.motion_gate is not None:
+            gate = hand_tracker.motion_gate
+            logging.info(f"動き検出: 推論 {gate.inferred} フレーム / 省略 {gate.skipped} フレーム")
+        if predictor is not None:
+            logging.info(f"指先の予測: 推論結果の取り込み {predictor.updates} 回 / 外挿 {predictor.predictions} 回")
+        if quality_controller is not None:
+            logging.info(f"品質レベルの変更 {len(quality_controller.decisions)} 回 / 最終レベル {quality_controller.level}")
+        if idle_monitor is not None:
+            mode_times = ", ".join(f"{mode} {seconds:.1f} 秒" for mode, seconds in vs.get_mode_times().items())
+            logging.info(f"キャプチャモード別の時間: {mode_times} (切り替え {idle_monitor.transitions} 回)")
+        if decoder is not None:
+            stats = decoder.get_stats()
+            logging.info(f"JPEG 展開: 全解像度 {stats['full']} / 縮小 {stats['reduced']} / 失敗 {stats['failed']} / "
+                         f"平均 {stats['avg_ms']:.2f} ms")
+        stats = vs.get_stats()
+        logging.info(f"フレーム統計: 取得 {stats['grabbed']} / デコード {stats['decoded']} / "
+                     f"重複読み出し {stats['duplicate_reads']} / 取りこぼし {stats['dropped_frames']}")
+        summary = metrics.summary()
+        logging.info(f"処理 {summary['frames']} フレーム / {summary['elapsed']:.1f} 秒 ({summary['fps']:.1f} FPS) / "
+                     f"1フレームの処理 平均 {summary['busy_ms']:.2f} ms / 平均遅延 {summary['latency_ms']:.1f} ms / "
+                     f"キーイベント {summary['key_events']}")
         vs.stop()
-        cv2.destroyAllWindows()
+        if not args.headless:
+            cv2.destroyAllWindows()
         logging.info("すべてのリソースを解放し、ウィンドウを閉じました。")
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ハンドトラッキングによる仮想キーボード")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="推論・キー判定・描画を別スレッドで並行実行する")
+    parser.add_argument("--queue-size", type=int, default=1,
+                        help="パイプラインの各ステージ間のキュー長 (既定: 1)")
+    parser.add_argument("--drop-policy", choices=LatestValueQueue.DROP_POLICIES, default=None,
+                        help="パイプライン・推論ワーカーの出力キューが満杯の時の挙動 "
+                             "(既定: drop_oldest。--pace max の動画・画像・合成フレームでは block)")
+    parser.add_argument("--inference-workers", type=int, default=0,
+                        help="MediaPipe の推論を行うワーカープロセス数 (0: メインプロセスで推論, 既定: 0)")
+    parser.add_argument("--capture-process", action="store_true",
+                        help="カメラの読み込みを別プロセスで行い、フレームを共有メモリで受け取る")
+    parser.add_argument("--source", default="camera", metavar="SOURCE",
+                        help="フレームの供給元 (camera[:番号] / video:PATH / images:DIR / synthetic[:フレーム数]。既定: camera)")
+    parser.add_argument("--pace", choices=("realtime", "max"), default="realtime",
+                        help="カメラ以外の供給元の速さ (realtime: 動画・指定の FPS で供給, "
+                             "max: 処理が終わり次第次のフレームを供給してフレームを落とさない。既定: realtime)")
+    parser.add_argument("--loop", action="store_true",
+                        help="動画・画像フォルダを最後まで読んだら先頭から繰り返す")
+    parser.add_argument("--mjpeg-passthrough", action="store_true",
+                        help="MJPG を OpenCV で BGR に変換せずに受け取り、ヘッドレスモードでは推論解像度まで縮小して展開する")
+    parser.add_argument("--probe-camera", action="store_true",
+                        help="FOURCC (MJPG/YUYV/H264) ごとに実際の FPS を計測して最速のモードを使う "
+                             "(結果は configs/camera_profiles.json に保存し、次回からは計測しない)")
+    parser.add_argument("--reprobe-camera", action="store_true",
+                        help="保存済みのプロファイルを使わずにカメラのモードを計測し直す")
+    parser.add_argument("--capture-size", type=int, nargs=2, default=[640, 360], metavar=("WIDTH", "HEIGHT"),
+                        help="カメラの取得・表示解像度 (既定: 640 360)")
+    parser.add_argument("--inference-scale", type=float, default=1.0,
+                        help="推論に渡す画像の縮小倍率 (例: 0.5 で縦横半分。既定: 1.0)")
+    parser.add_argument("--latency-budget", type=float, default=None, metavar="MS",
+                        help="フレーム取得からキー判定までの遅延の目標 [ms]。指定すると推論解像度・モデル・"
+                             "手の数・推論間引きを自動調整する")
+    parser.add_argument("--motion-gate", action="store_true",
+                        help="キーボード周辺に動きがないフレームでは推論せず、直前の指先位置を使う")
+    parser.add_argument("--motion-threshold", type=float, default=0.005,
+                        help="動きとみなす変化画素の割合 (既定: 0.005)")
+    parser.add_argument("--idle-after", type=float, default=None, metavar="SEC",
+                        help="手が見えない状態がこの秒数続いたら低解像度・低FPSの省電力モードに移行する")
+    parser.add_argument("--idle-capture", type=int, nargs=3, default=[320, 180, 10],
+                        metavar=("WIDTH", "HEIGHT", "FPS"),
+                        help="省電力モードのカメラ設定 (既定: 320 180 10)")
+    parser.add_argument("--headless", action="store_true",
+                        help="描画・ウィンドウ表示を行わず、キーイベントと処理性能の指標だけを出力する")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, metavar="SEC",
+                        help="ヘッドレスモードで処理性能の指標を出力する間隔 (既定: 5.0)")
+    parser.add_argument("--max-frames", type=int, default=None,
+                        help="このフレーム数を処理したら終了する (ベンチマーク用)")
+    parser.add_argument("--frame-skip", type=int, default=0,
+                        help="推論を省略するフレーム数 (1 なら2フレームに1回推論。既定: 0)")
+    parser.add_argument("--predict", action="store_true",
+                        help="指先の動きを予測し、推論しなかったフレームや処理遅延の分を外挿で補う")
+    parser.add_argument("--press-mode", choices=KeyEventEngine.PRESS_MODES, default="dwell",
+                        help="キー押下の判定方法 (dwell: 一定時間とどまる, depth: 指先の z で押し込みを検出。既定: dwell)")
+    parser.add_argument("--dwell-time", type=float, default=0.35, metavar="SEC",
+                        help="dwell 判定で押下とみなす滞在時間 (既定: 0.35)")
+    parser.add_argument("--depth-threshold", type=float, default=12.0, metavar="PX",
+                        help="depth 判定で押下とみなす指先 z の変化量 [px] (既定: 12.0)")
+    parser.add_argument("--output", type=_sink_spec, default="console", metavar="SINK",
+                        help="指とキーの対応・キーイベントの出力先 (console / file:PATH / tcp:HOST:PORT / memory / none。既定: console)")
+    parser.add_argument("--output-rate", type=float, default=None, metavar="LINES_PER_SEC",
+                        help="指とキーの対応の出力頻度の上限 [回/秒] (キーイベントは間引かない)")
+    parser.add_argument("--changes-only", action="store_true",
+                        help="指とキーの対応が前回の出力から変わった時だけ出力する")
+    parser.add_argument("--roi", action="store_true",
+                        help="キーボード周辺 (KEYBOARD_CORNERS の外接矩形 + 余白) だけを推論する")
+    parser.add_argument("--roi-margin", type=int, nargs=4, default=[40, 120, 40, 40],
+                        metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"),
+                        help="ROI の余白 [px] (既定: 40 120 40 40。上側は手がかざされる分を広めにとる)")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
     # loggingの基本設定
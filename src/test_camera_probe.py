@@ -0,0 +1,79 @@
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from CameraProbe import CameraProber, fourcc_to_str
+
+# カメラなしで CameraProber を確認する: FOURCC ごとに FPS と出力形状を変えた偽の VideoCapture を使う
+# 例: python test_camera_probe.py
+FAKE_FPS = {'MJPG': 30.0, 'YUYV': 10.0, 'H264': 60.0}
+
+class FakeCapture:
+    opened = 0
+
+    def __init__(self, src):
+        FakeCapture.opened += 1
+        self.props = {}
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        self.props[prop] = value
+        return True
+
+    def get(self, prop):
+        return self.props.get(prop, 0)
+
+    def grab(self):
+        return True
+
+    def read(self):
+        fourcc = fourcc_to_str(self.props[cv2.CAP_PROP_FOURCC])
+        time.sleep(1.0 / FAKE_FPS[fourcc])
+        width, height = int(self.props[cv2.CAP_PROP_FRAME_WIDTH]), int(self.props[cv2.CAP_PROP_FRAME_HEIGHT])
+        # H264 は OpenCV で展開されず、1列のバイト列として届く
+        shape = (1, width * height) if fourcc == 'H264' else (height, width, 3)
+        return True, np.zeros(shape, dtype=np.uint8)
+
+    def release(self):
+        pass
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "camera_profiles.json")
+        prober = CameraProber(capture_factory=FakeCapture, cache_path=cache_path, warmup_frames=1, probe_frames=6,
+                              identity_func=lambda src: f"fake:{src}")
+
+        results = prober.probe(0, 640, 360, 30)
+        for result in results:
+            print(result)
+        h264 = next(result for result in results if result['fourcc'] == 'H264')
+        assert not h264['valid'], "1列の H264 出力は無効とみなす"
+
+        profile = prober.select(results, 640, 360)
+        print("選択:", profile)
+        assert profile['fourcc'] == 'MJPG'
+
+        # 5% 以内の差なら先に調べた FOURCC (MJPG) を優先する
+        tie = [dict(results[0], measured_fps=29.0), dict(results[1], measured_fps=30.0, valid=True)]
+        assert CameraProber.select(tie, 640, 360)['fourcc'] == 'MJPG'
+        tie[1]['measured_fps'] = 31.0
+        assert CameraProber.select(tie, 640, 360)['fourcc'] == 'YUYV'
+
+        # 要求解像度に届かないモードは選ばない
+        assert CameraProber.select(results, 1280, 720) is None
+
+        # 1回目は計測して保存し、2回目はキャッシュから読む (カメラを開かない)
+        FakeCapture.opened = 0
+        first = prober.get_profile(0, 640, 360, 30)
+        second = prober.get_profile(0, 640, 360, 30)
+        print("キャッシュ:", second, f"(カメラを開いた回数: {FakeCapture.opened})")
+        assert first == second and FakeCapture.opened == 1
+        prober.get_profile(0, 640, 360, 30, reprobe=True)
+        assert FakeCapture.opened == 2
+
+    print("OK")
@@ -13,6 +13,9 @@ cap = cv2.VideoCapture(0,cv2.CAP_V4L2)#あってもなくてもあんま変わ
 time.sleep(0.1)
 
 # cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)#これをいれるとなぜかFPS下がる
+# → ドライバのバッファが1枚だと、アプリがそれを保持している間に届いたフレームは捨てられるため。
+#   遅延を減らしたい場合はバッファ数を減らすのではなく、別スレッドで grab() し続けて
+#   最新フレームだけを retrieve() する (WebcamVideoStream を参照)
 cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'H264'))#なんか一列になる。デコードが必要?
 # cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))#遅い。
 # cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))#圧縮してFPSを上げる
@@ -0,0 +1,27 @@
+import logging
+import sys
+
+from main import main, parse_args
+
+# ウィンドウ表示ありとヘッドレスで同じフレーム数を処理し、スループットを比較する
+# 例: python test_fps_headless.py 600 --pipeline
+# カメラなしで最大スループットを測る: python test_fps_headless.py 600 --source synthetic --pace max
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    extra_args = sys.argv[2:]
+
+    results = {}
+    for name, mode_args in (("windowed", []), ("headless", ["--headless"])):
+        results[name] = main(parse_args(mode_args + extra_args + ["--max-frames", str(frames), "--output", "none"]))
+
+    print(f"\n{'mode':<10} {'FPS':>8} {'処理 [ms/frame]':>16} {'遅延 [ms]':>10}")
+    for name, summary in results.items():
+        if summary is None:
+            print(f"{name:<10} (実行に失敗しました)")
+            continue
+        print(f"{name:<10} {summary['fps']:8.1f} {summary['busy_ms']:16.2f} {summary['latency_ms']:10.1f}")
+    if all(results.values()):
+        windowed, headless = results["windowed"], results["headless"]
+        print(f"\nスループット: x{headless['fps'] / windowed['fps']:.2f} / "
+              f"1フレームの処理時間: {windowed['busy_ms'] - headless['busy_ms']:.2f} ms 短縮")